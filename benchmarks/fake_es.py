@@ -0,0 +1,846 @@
+"""
+In-process stand-in for the Elasticsearch clusters, Topology and the Institution API
+
+FakeElasticsearch serves the endpoints this project calls from in-memory indices, evaluating the subset of the
+query DSL and aggregations we send (bool, range, term(s), exists and ids queries; terms, composite, range,
+date_histogram, sum, min, max and value_count aggregations). Runtime mappings are not evaluated, documents that
+should be searched with the painless ResourceName need a ResourceName field of their own.
+
+Topology is served under /topology and the Institution API under /institutions, point TOPOLOGY_HOST and
+INSTITUTION_API_HOST at those to run without the network.
+
+Requests the in-memory indices can't answer go to a cassette. When recording they are forwarded to the real
+services and their responses saved, when replaying the saved responses are returned so a run can be repeated
+deterministically offline. Indices matching the local patterns, the summary index, are always served in-memory so
+nothing is ever written upstream.
+
+```shell
+# Serve a synthetic week of jobs
+python3 -m benchmarks.fake_es --days 7
+
+# Record the responses of a run against the real services, then replay them
+python3 -m benchmarks.fake_es --record http://localhost:9200 --cassette data/cassette.json
+python3 -m benchmarks.fake_es --cassette data/cassette.json
+```
+"""
+import base64
+import datetime
+import fnmatch
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+import typer
+
+from benchmarks import synthetic
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upstreams requests under these path prefixes are recorded from, anything else goes to the Elasticsearch upstream
+TOPOLOGY_PREFIX = "/topology"
+INSTITUTION_PREFIX = "/institutions"
+TOPOLOGY_UPSTREAM = "https://topology.opensciencegrid.org"
+INSTITUTION_UPSTREAM = "https://topology-institutions.osg-htc.org"
+
+SHARDS = {"total": 1, "successful": 1, "skipped": 0, "failed": 0}
+
+
+class FakeElasticsearchError(Exception):
+    """An error returned to the client as an Elasticsearch error response"""
+
+    def __init__(self, status: int, error_type: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def to_dict(self):
+        return {"error": {"type": self.error_type, "reason": self.reason}, "status": self.status}
+
+
+class FakeIndex:
+    """An index holding its documents by id in insertion order, with a mapping inferred from them"""
+
+    def __init__(self, name: str, mappings: dict = None, settings: dict = None):
+        self.name = name
+        self.documents = {}
+        self.mappings = mappings or {"properties": {}}
+        self.settings = {"index": {"number_of_replicas": "1", "number_of_shards": "1", **(settings or {}).get("index", {})}}
+        self.creation_date = int(time.time() * 1000)
+
+    def put(self, document_id: str, source: dict):
+        """Index a document, returns True if it was created rather than overwritten"""
+
+        created = document_id not in self.documents
+        self.documents[document_id] = source
+        update_mapping(self.mappings.setdefault("properties", {}), source)
+
+        return created
+
+
+class FakeElasticsearch:
+    """
+    An HTTP server answering Elasticsearch, Topology and Institution API requests
+
+    :param cassette: Path of the recorded responses to replay, and to record into if record is set
+    :param record: The Elasticsearch URL to forward and record the requests the in-memory indices can't answer
+    :param local_indices: The indices that are always served in-memory, created empty up front, along with every
+        index named after them such as the generations of a rebuild
+    :param max_buckets: Fail searches whose aggregations create more buckets than this, like search.max_buckets
+    """
+
+    def __init__(self, cassette: str = None, record: str = None, local_indices: tuple = ("ospool-summary",), max_buckets: int = None):
+        self.indices = {}
+        self.aliases = {}
+        self.static = {}
+        self.pits = {}
+        self.tasks = {}
+        self.local_indices = local_indices
+        self.max_buckets = max_buckets
+        self.lock = threading.RLock()
+
+        for name in local_indices:
+            self.indices[name] = FakeIndex(name)
+
+        self.record = record
+        self.cassette_path = Path(cassette) if cassette is not None else None
+        self.cassette = {}
+        if self.cassette_path is not None and self.cassette_path.exists():
+            self.cassette = json.loads(self.cassette_path.read_text())
+
+        self.server = None
+        self.url = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start serving in a background thread, returns the URL served on"""
+
+        fake = self
+
+        class Handler(FakeRequestHandler):
+            server_fake = fake
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://{host}:{self.server.server_port}"
+
+        logger.info(f"Serving fake Elasticsearch on {self.url}")
+
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def topology_url(self):
+        return f"{self.url}{TOPOLOGY_PREFIX}"
+
+    @property
+    def institution_url(self):
+        return f"{self.url}{INSTITUTION_PREFIX}"
+
+    def add_documents(self, index_name: str, documents, ids: list = None):
+        """Add documents to an index, creating it if needed"""
+
+        with self.lock:
+            index = self.indices.setdefault(index_name, FakeIndex(index_name))
+            for document_id, document in zip(ids or iter(lambda: uuid.uuid4().hex, None), documents):
+                index.put(str(document_id), document)
+
+    def add_static(self, path: str, response):
+        """Serve a fixed JSON response on a path, ex. "/topology/miscproject/json" """
+
+        self.static[path] = response
+
+    def load_synthetic(self, start: datetime.datetime, days: int, jobs_per_day: int, institutions: int = 5, resources: int = 4, projects: int = 50, transfer_keys: int = 40, seed: int = 0, day_ranges: dict = None):
+        """
+        Fill the fake with synthetic schedd indices, topology and daily reports
+
+        :param day_ranges: Map of day to the (start, end) datetimes of the day's daily report, defaults to UTC days
+        """
+
+        schedd_documents = synthetic.generate_schedd_documents(start, days, jobs_per_day, institutions, resources, projects, synthetic.generate_transfer_keys(transfer_keys), seed)
+        for index_name, documents in schedd_documents.items():
+            self.add_documents(index_name, documents)
+
+        if day_ranges is None:
+            day_ranges = {
+                (start + datetime.timedelta(days=day)).date(): (start + datetime.timedelta(days=day), start + datetime.timedelta(days=day + 1))
+                for day in range(days)
+            }
+        daily_totals = synthetic.generate_daily_totals(schedd_documents, day_ranges)
+        self.add_documents("daily_totals", daily_totals.values(), ids=daily_totals.keys())
+
+        for path, response in synthetic.generate_topology(institutions, resources, projects).items():
+            prefix = INSTITUTION_PREFIX if path.startswith("api/") else TOPOLOGY_PREFIX
+            self.add_static(f"{prefix}/{path}", response)
+
+    def handle(self, method: str, path: str, params: dict, headers: dict, body: bytes):
+        """Answer a request, returns the status, content type and body of the response"""
+
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        try:
+            with self.lock:
+                if path in self.static:
+                    return 200, "application/json", json.dumps(self.static[path]).encode()
+
+                if not path.startswith((TOPOLOGY_PREFIX, INSTITUTION_PREFIX)):
+                    response = self.route(method, path, params, body)
+                    if response is not None:
+                        status, response = response
+                        if "filter_path" in params:
+                            response = apply_filter_path(response, params["filter_path"].split(",")) or {}
+
+                        return status, "application/json", json.dumps(response).encode()
+
+            return self.replay(method, path, params, body)
+
+        except FakeElasticsearchError as e:
+            return e.status, "application/json", json.dumps(e.to_dict()).encode()
+
+    def route(self, method: str, path: str, params: dict, body: bytes):
+        """Answer a request from the in-memory indices, returns None if they can't"""
+
+        parts = [part for part in path.split("/") if part]
+        request = json.loads(body) if body and not parts[-1].endswith(("_bulk", "_msearch")) else {}
+
+        # Endpoints that don't start with an index
+        if parts[0] == "_search":
+            return 200, self.search_pit(request)
+        if parts[0] == "_pit" and method == "DELETE":
+            self.pits.pop(request.get("id"), None)
+            return 200, {"succeeded": True, "num_freed": 1}
+        if parts[0] == "_bulk":
+            return 200, self.bulk(None, body)
+        if parts[0] == "_reindex":
+            return 200, self.run_task(params, lambda: self.reindex(request))
+        if parts[0] == "_tasks":
+            return 200, self.tasks[parts[1]]
+        if parts[0] == "_aliases":
+            return 200, self.update_aliases(request["actions"])
+        if parts[0] == "_cluster" and parts[1] == "health":
+            # Every in-memory index lives on one node with nothing to allocate
+            return 200, {"status": "green", "timed_out": False}
+        if parts[0] == "_cat" and parts[1] == "indices":
+            return 200, self.cat_indices(parts[2] if len(parts) > 2 else "*", params)
+
+        expression, endpoint = parts[0], parts[1] if len(parts) > 1 else None
+        is_local = expression.startswith(self.local_indices)
+
+        # Index management and writes are only done locally
+        if endpoint is None and method == "PUT":
+            return 200, self.create_index(expression, request)
+        if endpoint == "_bulk" or (endpoint == "_doc" and len(parts) > 2 and parts[2] == "_bulk"):
+            return 200, self.bulk(expression, body)
+
+        indices = self.resolve(expression)
+        if not indices:
+            if not is_local:
+                return None
+
+            if endpoint in ("_search", "_count", "_delete_by_query"):
+                raise FakeElasticsearchError(404, "index_not_found_exception", f"no such index [{expression}]")
+
+        if endpoint is None and method == "GET":
+            return 200, {name: self.get_index(name) for name in indices}
+        if endpoint is None and method == "DELETE":
+            for name in indices:
+                del self.indices[name]
+            return 200, {"acknowledged": True}
+        if endpoint == "_search":
+            return 200, self.search(indices, request)
+        if endpoint == "_msearch":
+            lines = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+            return 200, {"responses": [self.search(self.resolve(header.get("index", expression)), query) for header, query in zip(lines[::2], lines[1::2])]}
+        if endpoint == "_count":
+            return 200, {"count": len(self.match(indices, request.get("query"))), "_shards": SHARDS}
+        if endpoint == "_delete_by_query":
+            return 200, self.run_task(params, lambda: self.delete_by_query(indices, request))
+        if endpoint == "_mapping":
+            return 200, {name: {"mappings": self.indices[name].mappings} for name in indices}
+        if endpoint == "_settings":
+            for name in indices:
+                self.indices[name].settings["index"].update({k: v for k, v in request.get("index", request).items() if v is not None})
+            return 200, {"acknowledged": True}
+        if endpoint == "_refresh":
+            return 200, {"_shards": SHARDS}
+        if endpoint == "_pit":
+            pit_id = base64.b64encode(uuid.uuid4().bytes).decode()
+            self.pits[pit_id] = [(name, document_id, source) for name in indices for document_id, source in self.indices[name].documents.items()]
+            return 200, {"id": pit_id}
+
+        raise FakeElasticsearchError(400, "unsupported_operation_exception", f"{method} {path} is not supported by the fake")
+
+    def resolve(self, expression: str):
+        """Get the names of the indices an index expression, ex. "osg-schedd-*,alias", refers to"""
+
+        names = []
+        for part in expression.split(","):
+            if part in self.aliases:
+                names.extend(sorted(self.aliases[part]))
+            elif any(c in part for c in "*?"):
+                names.extend(name for name in sorted(self.indices) if fnmatch.fnmatch(name, part))
+            elif part in self.indices:
+                names.append(part)
+
+        return list(dict.fromkeys(names))
+
+    def match(self, indices: list, query: dict):
+        """Get the (index, id, source) of the documents matching a query"""
+
+        return [
+            (name, document_id, source)
+            for name in indices
+            for document_id, source in self.indices[name].documents.items()
+            if matches(document_id, source, query)
+        ]
+
+    def search(self, indices: list, request: dict):
+        start = time.perf_counter()
+        hits = self.match(indices, request.get("query"))
+
+        return self.search_response(hits, request, start)
+
+    def search_pit(self, request: dict):
+        """Search the snapshot of a point in time, paging on its document order"""
+
+        start = time.perf_counter()
+        pit_id = request["pit"]["id"]
+        if pit_id not in self.pits:
+            raise FakeElasticsearchError(404, "search_context_missing_exception", f"No search context found for id [{pit_id}]")
+
+        after = request.get("search_after", [-1])[0]
+        hits = [
+            (name, document_id, source, [position])
+            for position, (name, document_id, source) in enumerate(self.pits[pit_id])
+            if position > after and matches(document_id, source, request.get("query"))
+        ]
+
+        return {"pit_id": pit_id, **self.search_response(hits, request, start)}
+
+    def search_response(self, hits: list, request: dict, start: float):
+        size = request.get("size", 10)
+        offset = request.get("from", 0)
+
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "_shards": SHARDS,
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": None,
+                "hits": [
+                    {
+                        "_index": hit[0],
+                        "_id": hit[1],
+                        "_score": None,
+                        "_source": filter_source(hit[2], request.get("_source", True)),
+                        **({"sort": hit[3]} if len(hit) > 3 else {})
+                    }
+                    for hit in hits[offset:offset + size]
+                ]
+            }
+        }
+
+        aggs = request.get("aggs", request.get("aggregations"))
+        if aggs:
+            response["aggregations"] = aggregate(hits, aggs)
+
+            if self.max_buckets is not None and count_buckets(response["aggregations"]) > self.max_buckets:
+                raise FakeElasticsearchError(400, "too_many_buckets_exception", f"Trying to create too many buckets. Must be less than or equal to: [{self.max_buckets}]")
+
+        response["took"] = int((time.perf_counter() - start) * 1000)
+
+        return response
+
+    def bulk(self, default_index: str, body: bytes):
+        start = time.perf_counter()
+        lines = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+
+        items = []
+        i = 0
+        while i < len(lines):
+            (action, meta), = lines[i].items()
+            index_name = meta.get("_index", default_index)
+            document_id = str(meta.get("_id") or uuid.uuid4().hex)
+            index = self.indices.setdefault(index_name, FakeIndex(index_name))
+
+            if action == "delete":
+                found = index.documents.pop(document_id, None) is not None
+                items.append({action: {"_index": index_name, "_id": document_id, "status": 200 if found else 404, "result": "deleted" if found else "not_found"}})
+                i += 1
+                continue
+
+            created = index.put(document_id, lines[i + 1])
+            items.append({action: {"_index": index_name, "_id": document_id, "status": 201 if created else 200, "result": "created" if created else "updated"}})
+            i += 2
+
+        return {"took": int((time.perf_counter() - start) * 1000), "errors": False, "items": items}
+
+    def delete_by_query(self, indices: list, request: dict):
+        hits = self.match(indices, request.get("query"))
+        for name, document_id, _ in hits:
+            del self.indices[name].documents[document_id]
+
+        return {"took": 0, "timed_out": False, "total": len(hits), "deleted": len(hits), "failures": []}
+
+    def reindex(self, request: dict):
+        source, dest = request["source"], request["dest"]
+        dest_index = self.indices.setdefault(dest["index"], FakeIndex(dest["index"]))
+
+        created = updated = 0
+        for _, document_id, document in self.match(self.resolve(source["index"]), source.get("query")):
+            if dest_index.put(document_id, document):
+                created += 1
+            else:
+                updated += 1
+
+        return {"took": 0, "timed_out": False, "total": created + updated, "created": created, "updated": updated, "failures": []}
+
+    def run_task(self, params: dict, run):
+        """Run a task now, returning its task id instead of its result if it was not waited for"""
+
+        result = run()
+        if params.get("wait_for_completion", "true") == "true":
+            return result
+
+        task_id = f"fake:{len(self.tasks) + 1}"
+        self.tasks[task_id] = {"completed": True, "task": {"status": result}, "response": result}
+
+        return {"task": task_id}
+
+    def create_index(self, name: str, request: dict):
+        if name in self.indices:
+            raise FakeElasticsearchError(400, "resource_already_exists_exception", f"index [{name}] already exists")
+
+        self.indices[name] = FakeIndex(name, json.loads(json.dumps(request.get("mappings") or {})), request.get("settings"))
+
+        return {"acknowledged": True, "index": name}
+
+    def get_index(self, name: str):
+        index = self.indices[name]
+        aliases = {alias: {} for alias, names in self.aliases.items() if name in names}
+
+        return {"aliases": aliases, "mappings": index.mappings, "settings": index.settings}
+
+    def update_aliases(self, actions: list):
+        for action in actions:
+            (kind, body), = action.items()
+            if kind == "add":
+                self.aliases.setdefault(body["alias"], set()).add(body["index"])
+            elif kind == "remove":
+                self.aliases.get(body["alias"], set()).discard(body["index"])
+            elif kind == "remove_index":
+                del self.indices[body["index"]]
+
+        return {"acknowledged": True}
+
+    def cat_indices(self, expression: str, params: dict):
+        columns = params.get("h", "index,docs.count").split(",")
+        rows = []
+        for name in self.resolve(expression):
+            index = self.indices[name]
+            values = {"index": name, "creation.date": str(index.creation_date), "docs.count": str(len(index.documents)), "health": "green", "status": "open"}
+            rows.append({column: values.get(column) for column in columns})
+
+        return rows
+
+    def replay(self, method: str, path: str, params: dict, body: bytes):
+        """Answer a request from the cassette, recording it from upstream first if recording"""
+
+        key = get_cassette_key(method, path, params, body)
+        if key not in self.cassette and self.record is not None:
+            self.cassette[key] = self.fetch_upstream(method, path, params, body)
+            self.save_cassette()
+
+        if key not in self.cassette:
+            error = FakeElasticsearchError(404, "cassette_miss_exception", f"No recorded response for {method} {path}")
+            return error.status, "application/json", json.dumps(error.to_dict()).encode()
+
+        recorded = self.cassette[key]
+
+        return recorded["status"], recorded["content_type"], base64.b64decode(recorded["body"])
+
+    def fetch_upstream(self, method: str, path: str, params: dict, body: bytes):
+        if path.startswith(TOPOLOGY_PREFIX):
+            url = TOPOLOGY_UPSTREAM + path[len(TOPOLOGY_PREFIX):]
+        elif path.startswith(INSTITUTION_PREFIX):
+            url = INSTITUTION_UPSTREAM + path[len(INSTITUTION_PREFIX):]
+        else:
+            url = self.record + path
+
+        logger.info(f"Recording {method} {url}")
+        response = requests.request(method, url, params=params, data=body or None, headers={"Content-Type": "application/json"}, verify=False)
+
+        return {
+            "method": method,
+            "path": path,
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/json"),
+            "body": base64.b64encode(response.content).decode()
+        }
+
+    def save_cassette(self):
+        tmp_path = self.cassette_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.cassette, indent=1, sort_keys=True))
+        tmp_path.rename(self.cassette_path)
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_fake: FakeElasticsearch = None
+
+    def do_request(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        status, content_type, response = self.server_fake.handle(self.command, url.path, dict(parse_qsl(url.query)), dict(self.headers), body)
+
+        # Tag GET responses with their content hash so conditional requests can be answered with a 304
+        etag = None
+        if self.command == "GET" and status == 200:
+            etag = f'"{hashlib.sha256(response).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                status, response = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(response)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_request
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def get_cassette_key(method: str, path: str, params: dict, body: bytes):
+    """Key a request on its method, path, params and body, JSON bodies are compared ignoring key order"""
+
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True) if body else ""
+    except ValueError:
+        body = body.decode(errors="replace")
+
+    return hashlib.sha256(json.dumps([method, path, sorted(params.items()), body]).encode()).hexdigest()
+
+
+def update_mapping(properties: dict, source: dict):
+    """Add the fields of a document to a mapping the way dynamic mapping would"""
+
+    for key, value in source.items():
+        if isinstance(value, dict):
+            update_mapping(properties.setdefault(key, {}).setdefault("properties", {}), value)
+        elif key not in properties:
+            if isinstance(value, bool):
+                properties[key] = {"type": "boolean"}
+            elif isinstance(value, int):
+                properties[key] = {"type": "long"}
+            elif isinstance(value, float):
+                properties[key] = {"type": "float"}
+            elif isinstance(value, str):
+                properties[key] = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+
+
+def get_values(source: dict, field: str):
+    """Get the values of a field of a document, the .keyword sub-field is the field itself"""
+
+    if field.endswith(".keyword"):
+        field = field[:-len(".keyword")]
+
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return []
+        value = value[part]
+
+    if value is None:
+        return []
+
+    return value if isinstance(value, list) else [value]
+
+
+def to_comparable(value):
+    """Compare dates as timestamps, the range queries mix "2025-01-01" dates and "2025-01-01T00:00:00" datetimes"""
+
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return value
+
+    return value
+
+
+def as_list(value):
+    if value is None:
+        return []
+
+    return value if isinstance(value, list) else [value]
+
+
+def matches(document_id: str, source: dict, query: dict):
+    """Check if a document matches a query"""
+
+    if not query or "match_all" in query:
+        return True
+
+    (kind, body), = query.items()
+
+    if kind == "bool":
+        required = as_list(body.get("filter")) + as_list(body.get("must"))
+        if not all(matches(document_id, source, q) for q in required):
+            return False
+
+        if any(matches(document_id, source, q) for q in as_list(body.get("must_not"))):
+            return False
+
+        should = as_list(body.get("should"))
+        minimum_should_match = body.get("minimum_should_match", 0 if required else 1)
+        if should and sum(matches(document_id, source, q) for q in should) < minimum_should_match:
+            return False
+
+        return True
+
+    if kind == "ids":
+        return document_id in body["values"]
+
+    if kind == "exists":
+        return len(get_values(source, body["field"])) > 0
+
+    (field, condition), = body.items()
+    values = [document_id] if field == "_id" else get_values(source, field)
+
+    if kind == "term":
+        condition = condition["value"] if isinstance(condition, dict) else condition
+        return condition in values
+
+    if kind == "terms":
+        return any(value in condition for value in values)
+
+    if kind == "range":
+        bounds = {op: to_comparable(bound) for op, bound in condition.items() if op in ("gte", "gt", "lte", "lt")}
+        for value in map(to_comparable, values):
+            if all((
+                "gte" not in bounds or value >= bounds["gte"],
+                "gt" not in bounds or value > bounds["gt"],
+                "lte" not in bounds or value <= bounds["lte"],
+                "lt" not in bounds or value < bounds["lt"],
+            )):
+                return True
+        return False
+
+    raise FakeElasticsearchError(400, "parsing_exception", f"The fake does not support [{kind}] queries")
+
+
+def filter_source(source: dict, includes):
+    if includes is True:
+        return source
+    if includes is False:
+        return {}
+
+    if isinstance(includes, dict):
+        includes = includes.get("includes", [])
+
+    return {k: v for k, v in source.items() if any(fnmatch.fnmatch(k, pattern) for pattern in as_list(includes))}
+
+
+def get_hit_values(hit: tuple, field: str):
+    return [hit[0]] if field == "_index" else get_values(hit[2], field)
+
+
+def count_buckets(aggregations: dict):
+    """Count the buckets of evaluated aggregations, sub aggregation buckets included"""
+
+    total = 0
+    for result in aggregations.values():
+        if not isinstance(result, dict) or "buckets" not in result:
+            continue
+
+        buckets = result["buckets"].values() if isinstance(result["buckets"], dict) else result["buckets"]
+        for bucket in buckets:
+            total += 1 + count_buckets(bucket)
+
+    return total
+
+
+def aggregate(hits: list, aggs: dict):
+    """Evaluate aggregations over the (index, id, source) hits"""
+
+    results = {}
+    for name, agg in aggs.items():
+        sub_aggs = agg.get("aggs", agg.get("aggregations", {}))
+        kind = next(k for k in agg if k not in ("aggs", "aggregations", "meta"))
+        body = agg[kind]
+
+        if kind in ("sum", "min", "max", "value_count"):
+            values = [v for hit in hits for v in get_hit_values(hit, body["field"]) if isinstance(v, (int, float))]
+            if kind == "sum":
+                results[name] = {"value": float(sum(values))}
+            elif kind == "value_count":
+                results[name] = {"value": len(values)}
+            else:
+                results[name] = {"value": float((min if kind == "min" else max)(values)) if values else None}
+
+        elif kind == "terms":
+            groups = {}
+            for hit in hits:
+                values = get_hit_values(hit, body["field"]) or ([body["missing"]] if "missing" in body else [])
+                for value in set(values):
+                    groups.setdefault(value, []).append(hit)
+
+            keys = sorted(groups, key=lambda k: (-len(groups[k]), k))[:body.get("size", 10)]
+            results[name] = {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(len(g) for k, g in groups.items() if k not in keys),
+                "buckets": [{"key": k, "doc_count": len(groups[k]), **aggregate(groups[k], sub_aggs)} for k in keys]
+            }
+
+        elif kind == "composite":
+            sources = [next(iter(s.items())) for s in body["sources"]]
+            groups = {}
+            for hit in hits:
+                per_source = []
+                for _, source in sources:
+                    field = source["terms"]["field"]
+                    values = get_hit_values(hit, field) or ([None] if source["terms"].get("missing_bucket") else [])
+                    per_source.append(set(values))
+                for key in itertools.product(*per_source):
+                    groups.setdefault(key, []).append(hit)
+
+            # Missing values sort first, as in Elasticsearch
+            ordered = sorted(groups, key=lambda key: [(v is not None, v) for v in key])
+            if "after" in body:
+                after = tuple(body["after"][source_name] for source_name, _ in sources)
+                ordered = [key for key in ordered if [(v is not None, v) for v in key] > [(v is not None, v) for v in after]]
+
+            page = ordered[:body.get("size", 10)]
+            buckets = [
+                {"key": dict(zip([source_name for source_name, _ in sources], key)), "doc_count": len(groups[key]), **aggregate(groups[key], sub_aggs)}
+                for key in page
+            ]
+            results[name] = {"buckets": buckets, **({"after_key": buckets[-1]["key"]} if buckets else {})}
+
+        elif kind in ("range", "date_range"):
+            # Only the epoch_second format of date_range is supported, its bounds are strings of seconds
+            if kind == "date_range" and body.get("format") != "epoch_second":
+                raise FakeElasticsearchError(400, "parsing_exception", f"The fake does not support the [{body.get('format')}] date_range format")
+
+            buckets = []
+            for r in body["ranges"]:
+                r = {k: float(v) if kind == "date_range" and k in ("from", "to") else v for k, v in r.items()}
+                in_range = [
+                    hit for hit in hits
+                    if any(("from" not in r or v >= r["from"]) and ("to" not in r or v < r["to"]) for v in get_hit_values(hit, body["field"]))
+                ]
+                key = r.get("key", f"{r.get('from', '*')}-{r.get('to', '*')}")
+                buckets.append({"key": key, **{k: r[k] for k in ("from", "to") if k in r}, "doc_count": len(in_range), **aggregate(in_range, sub_aggs)})
+
+            results[name] = {"buckets": {b.pop("key"): b for b in buckets} if body.get("keyed") else buckets}
+
+        elif kind == "date_histogram":
+            groups = {}
+            for hit in hits:
+                for value in get_hit_values(hit, body["field"]):
+                    day = datetime.datetime.fromtimestamp(to_comparable(value), datetime.timezone.utc).date() if not isinstance(value, str) else datetime.date.fromisoformat(value[:10])
+                    groups.setdefault(day, []).append(hit)
+
+            results[name] = {"buckets": [
+                {
+                    "key_as_string": day.isoformat(),
+                    "key": int(datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc).timestamp() * 1000),
+                    "doc_count": len(groups[day]),
+                    **aggregate(groups[day], sub_aggs)
+                }
+                for day in sorted(groups) if len(groups[day]) >= body.get("min_doc_count", 0)
+            ]}
+
+        else:
+            raise FakeElasticsearchError(400, "parsing_exception", f"The fake does not support [{kind}] aggregations")
+
+    return results
+
+
+def apply_filter_path(value, paths: list):
+    """Keep only the parts of a response matching the filter_path paths, dropping anything left empty"""
+
+    return _filter(value, [path.split(".") for path in paths])
+
+
+def _filter(value, paths: list):
+    if any(len(path) == 0 for path in paths):
+        return value
+
+    if isinstance(value, list):
+        filtered = [_filter(v, paths) for v in value]
+        filtered = [v for v in filtered if v is not None]
+        return filtered or None
+
+    if not isinstance(value, dict):
+        return None
+
+    filtered = {}
+    for key, v in value.items():
+        remaining = [path[1:] for path in paths if path[0] == "*" or fnmatch.fnmatch(key, path[0])]
+        if remaining:
+            v = _filter(v, remaining)
+            if v is not None:
+                filtered[key] = v
+
+    return filtered or None
+
+
+app = typer.Typer()
+
+
+@app.command()
+def serve(port: int = 9201, days: int = 7, jobs_per_day: int = 2000, cassette: str = None, record: str = None):
+    """
+    Serve a synthetic week of jobs, or replay a cassette
+
+    :param cassette: The recorded responses to replay, recorded into if record is set
+    :param record: The Elasticsearch URL to record the responses from
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    fake = FakeElasticsearch(cassette=cassette, record=record)
+    if cassette is None:
+        start = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=days)
+        fake.load_synthetic(start, days, jobs_per_day)
+
+    url = fake.start(port=port)
+    print(f"ES_HOST={url} ES_PROVIDER_HOST={url} TOPOLOGY_HOST={fake.topology_url} INSTITUTION_API_HOST={fake.institution_url}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,41 @@
+"""
+Compares flatten_aggregates against the vectorized flatten_aggregates_columnar on a synthetic response
+"""
+import time
+
+import typer
+from rich import print
+
+from benchmarks.synthetic import generate_transfer_keys, generate_aggregation_response
+from summarize.adstash import flatten_aggregates, flatten_aggregates_columnar, split_transfer_keys
+
+app = typer.Typer()
+
+
+@app.command()
+def flatten(institutions: int = 10, resources: int = 20, projects: int = 50, transfer_keys: int = 300, repeat: int = 3):
+    """Time both flatten paths on institutions x resources x projects buckets with the given number of transfer keys"""
+
+    transfer_key_groups = split_transfer_keys(generate_transfer_keys(transfer_keys))
+    response = generate_aggregation_response(institutions, resources, projects, transfer_key_groups.transfer_keys)
+
+    print(f"[yellow]Flattening {institutions * resources * projects} buckets with {transfer_keys} transfer keys[/yellow]")
+
+    timings = {}
+    for label, flatten_function in (
+            ("Dict", lambda: flatten_aggregates(response, None, transfer_key_groups=transfer_key_groups)),
+            ("Columnar", lambda: flatten_aggregates_columnar(response, None, transfer_key_groups=transfer_key_groups)),
+            ("Columnar DataFrame", lambda: flatten_aggregates_columnar(response, None, as_dataframe=True, transfer_key_groups=transfer_key_groups)),
+    ):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            flatten_function()
+            best = min(best, time.perf_counter() - start)
+
+        timings[label] = best
+        print(f"[yellow]{label.ljust(18)}: {best * 1000:.1f}ms, {timings['Dict'] / best:.2f}x[/yellow]")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,84 @@
+"""
+Times push_summary_date end to end against the fake Elasticsearch, with no network
+
+The fake is filled with synthetic schedd indices, daily reports and topology, or replays a cassette recorded from
+the real services. The summary index is always in-memory so pushes can be repeated. The push runs in Central Time,
+as on the production hosts, so the summary documents are dated the way they are there.
+"""
+import contextlib
+import datetime
+import io
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import typer
+from rich import print
+
+from benchmarks.fake_es import FakeElasticsearch
+from cli.push_summary_date import push_summary_date, get_central_day_range
+from summarize import adstash, metrics
+
+app = typer.Typer()
+
+
+@app.command()
+def push_summary(start: datetime.datetime = typer.Argument("2025-03-01", formats=["%Y-%m-%d"]), days: int = 7, jobs_per_day: int = 2000, days_per_query: int = 1, repeat: int = 3, cassette: str = None):
+    """
+    Push `days` days of summaries `repeat` times and report the throughput, the latency of each fetched batch of days
+    and of indexing each day
+
+    :param cassette: Replay this cassette instead of serving synthetic data, it must cover the same days
+    """
+
+    os.environ["TZ"] = "America/Chicago"
+    time.tzset()
+
+    dates = [(start + datetime.timedelta(days=day)).date() for day in range(days)]
+
+    fake = FakeElasticsearch(cassette=cassette)
+    if cassette is None:
+        print(f"[yellow]Generating {days} days of {jobs_per_day} jobs[/yellow]")
+        day_ranges = {date: get_central_day_range(date) for date in dates}
+        fake.load_synthetic(start - datetime.timedelta(days=1), days + 2, jobs_per_day, day_ranges=day_ranges)
+
+    # Keep the adstash caches and topology snapshots of the fake out of ./data
+    cache_dir = Path(tempfile.mkdtemp())
+    adstash.TRANSFER_KEY_CACHE = cache_dir / "transfer-key-cache.json"
+    adstash.INDEX_RANGE_CACHE = cache_dir / "schedd-index-ranges.json"
+    os.environ["SNAPSHOT_DIR"] = str(cache_dir / "snapshots")
+
+    run_seconds = []
+    fetch_seconds = []
+    day_seconds = []
+    with fake:
+        os.environ["TOPOLOGY_HOST"] = fake.topology_url
+        os.environ["INSTITUTION_API_HOST"] = fake.institution_url
+
+        for i in range(repeat):
+            metrics.reset()
+
+            run_start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                push_summary_date(
+                    datetime.datetime.combine(dates[0], datetime.time()), fake.url, fake.url, "ospool-summary", None, None,
+                    not_interactive=True, regenerate=True, end=datetime.datetime.combine(dates[-1], datetime.time()), days_per_query=days_per_query
+                )
+            run_seconds.append(time.perf_counter() - run_start)
+
+            fetch_seconds.extend(s.wall_seconds for s in metrics.get_spans() if s.stage == "fetch")
+            day_seconds.extend(s.wall_seconds for s in metrics.get_spans() if s.stage == "day")
+
+            print(f"[yellow]Run {i}: {run_seconds[-1]:.2f}s, {len(fake.indices['ospool-summary'].documents)} summary documents[/yellow]")
+
+    print(f"[green]Throughput: {days / statistics.median(run_seconds):.2f} days/s, median run {statistics.median(run_seconds):.2f}s[/green]")
+
+    # The batches of days are pulled concurrently, then each day is indexed in order
+    for name, seconds in (("Fetch", sorted(fetch_seconds)), ("Index", sorted(day_seconds))):
+        print(f"[green]{name} latency: median {statistics.median(seconds):.3f}s, p95 {seconds[int(len(seconds) * .95)]:.3f}s, max {seconds[-1]:.3f}s[/green]")
+
+
+if __name__ == "__main__":
+    app()
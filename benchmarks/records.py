@@ -0,0 +1,64 @@
+"""
+Compares the peak RSS of flattening a synthetic response into dict records against the compact FlatRecordBatch
+
+Each representation is measured in its own process so the peaks don't mask each other. The heap still held by the
+records once the responses are freed is reported alongside the peak RSS.
+"""
+import gc
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+import typer
+from rich import print
+
+from benchmarks.synthetic import generate_transfer_keys, generate_aggregation_response
+from summarize.adstash import flatten_aggregates, split_transfer_keys
+
+app = typer.Typer()
+
+
+@app.command()
+def compare(institutions: int = 10, resources: int = 20, projects: int = 50, transfer_keys: int = 300, days: int = 7):
+    """Report the RSS of holding `days` flattened responses as dicts and as compact records"""
+
+    print(f"[yellow]Holding {days} days of {institutions * resources * projects} records with {transfer_keys} transfer keys[/yellow]")
+
+    rss = {}
+    for compact in (False, True):
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.records", "measure", "--compact" if compact else "--no-compact", str(institutions), str(resources), str(projects), str(transfer_keys), str(days)],
+            capture_output=True, text=True, check=True
+        )
+        rss[compact] = [int(x) for x in result.stdout.strip().splitlines()[-1].split()]
+
+        print(f"[yellow]{'Compact' if compact else 'Dict'}".ljust(16) + f": {rss[compact][0] / 1024:.1f}MiB peak RSS, {rss[compact][1] / 1024:.1f}MiB retained heap[/yellow]")
+
+    print(f"[green]Peak reduction: {rss[False][0] / rss[True][0]:.2f}x, retained reduction: {rss[False][1] / rss[True][1]:.2f}x[/green]")
+
+
+@app.command(hidden=True)
+def measure(institutions: int, resources: int, projects: int, transfer_keys: int, days: int, compact: bool = False):
+    """Flatten `days` responses, keeping the records but not the responses, and print the peak and retained RSS in KiB"""
+
+    transfer_key_groups = split_transfer_keys(generate_transfer_keys(transfer_keys))
+
+    # RSS stays high after the responses are freed as the allocator keeps its arenas, so trace the retained heap
+    tracemalloc.start()
+
+    flat_responses = []
+    for day in range(days):
+        response = generate_aggregation_response(institutions, resources, projects, transfer_key_groups.transfer_keys, seed=day)
+        flat_responses.append(flatten_aggregates(response, None, compact=compact, transfer_key_groups=transfer_key_groups))
+
+        del response
+        gc.collect()
+
+    retained, _ = tracemalloc.get_traced_memory()
+
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, retained // 1024)
+
+
+if __name__ == "__main__":
+    app()
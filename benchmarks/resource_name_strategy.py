@@ -0,0 +1,56 @@
+"""
+Compares the ES `took` time of deriving the ResourceName with the painless runtime mapping
+against bucketing on the source fields and resolving it client-side
+"""
+import statistics
+from datetime import datetime
+
+import typer
+from rich import print
+
+from cli.push_summary_date import get_central_day_range
+from summarize.adstash import get_terms_aggregates, get_runtime_mappings, get_query_filter, search_adstash, flatten_aggregates
+
+app = typer.Typer()
+
+
+@app.command()
+def resource_name_strategy(date: datetime, host: str = "http://localhost:9200", repeat: int = 5):
+    """Run the summary query for a day with and without the runtime mapping and report the ES took times"""
+
+    start, end = get_central_day_range(date.date())
+
+    tooks = {True: [], False: []}
+    flat_responses = {}
+    for _ in range(repeat):
+
+        # Alternate the strategies so neither benefits from a warmer cluster
+        for resource_name_script in (True, False):
+            query = {
+                "size": 0,
+                "aggs": get_terms_aggregates(host, resource_name_script),
+                **get_runtime_mappings(resource_name_script),
+                "query": get_query_filter(start, end)
+            }
+
+            # Skip the shard request cache, otherwise every run after the first is a cache hit
+            response_json = search_adstash(query, host, params={"request_cache": "false"})
+
+            tooks[resource_name_script].append(response_json['took'])
+            flat_responses[resource_name_script] = flatten_aggregates(response_json, host)
+
+    for resource_name_script, label in ((True, "Painless runtime mapping"), (False, "Client-side resolution")):
+        took = tooks[resource_name_script]
+        print(f"[yellow]{label.ljust(24)}: median {statistics.median(took)}ms, mean {statistics.mean(took):.1f}ms, min {min(took)}ms, max {max(took)}ms[/yellow]")
+
+    print(f"[green]Speedup: {statistics.median(tooks[True]) / max(statistics.median(tooks[False]), 1):.2f}x[/green]")
+
+    # Both strategies should produce the same records
+    script_records = {(r['InstitutionID'], r['ResourceName'], r['AcctGroup']): r['NumJobs'] for r in flat_responses[True]}
+    field_records = {(r['InstitutionID'], r['ResourceName'], r['AcctGroup']): r['NumJobs'] for r in flat_responses[False]}
+    if script_records != field_records:
+        print(f"[bold red]Strategies disagree on {len(set(script_records.items()) ^ set(field_records.items()))} records[/bold red]")
+
+
+if __name__ == "__main__":
+    app()
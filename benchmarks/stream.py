@@ -0,0 +1,47 @@
+"""
+Compares the peak memory of loading a synthetic response whole against streaming its flat records
+"""
+import io
+import json
+import tracemalloc
+
+import typer
+from rich import print
+
+from benchmarks.synthetic import generate_transfer_keys, generate_aggregation_response
+from summarize.adstash import flatten_aggregates, iter_flat_records, split_transfer_keys
+
+app = typer.Typer()
+
+
+@app.command()
+def stream(institutions: int = 10, resources: int = 20, projects: int = 50, transfer_keys: int = 300):
+    """Report the peak traced memory of consuming the flat records of a response body both ways"""
+
+    transfer_key_groups = split_transfer_keys(generate_transfer_keys(transfer_keys))
+    body = json.dumps(generate_aggregation_response(institutions, resources, projects, transfer_key_groups.transfer_keys)).encode()
+
+    print(f"[yellow]Consuming a {len(body) / 2 ** 20:.1f}MiB response of {institutions * resources * projects} buckets[/yellow]")
+
+    peaks = {}
+    for label in ("Loaded", "Streamed"):
+        tracemalloc.start()
+
+        # Consume the records one at a time as get_summary_records does, keeping none of them
+        if label == "Loaded":
+            for _ in flatten_aggregates(json.load(io.BytesIO(body)), None, transfer_key_groups=transfer_key_groups):
+                pass
+        else:
+            for _ in iter_flat_records(io.BytesIO(body), transfer_key_groups):
+                pass
+
+        _, peaks[label] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"[yellow]{label.ljust(8)}: {peaks[label] / 2 ** 20:.1f}MiB peak[/yellow]")
+
+    print(f"[green]Reduction: {peaks['Loaded'] / peaks['Streamed']:.1f}x[/green]")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,214 @@
+"""
+Benchmarks the stages of the summary pipeline on synthetic data and compares them to a stored baseline
+
+Each benchmark is timed `repeat` times after a warmup run and summarized by its min, median, p95, mean and standard
+deviation. A benchmark regresses when its median is more than `tolerance` slower than the baseline median, the
+run then exits non-zero so it can gate a change. Baselines are only comparable on the machine that saved them.
+
+Topology, the Institution API and daily_totals are served by the in-process fake Elasticsearch.
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import typer
+from rich import print
+
+from benchmarks import synthetic
+from benchmarks.fake_es import FakeElasticsearch
+from summarize.adstash import flatten_aggregates, split_transfer_keys
+from summarize.es import iter_bulk_chunks
+from summarize.field_of_science import FieldOfScienceMapper
+from summarize.main import map_summary_records, get_summary_record_id
+from summarize.validate import compare_summary_to_daily
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+# Workload sizes as institutions, resources, projects and transfer keys
+SCALES = {
+    "small": (5, 10, 20, 50),
+    "medium": (10, 20, 50, 300),
+    "large": (20, 40, 100, 600),
+}
+
+BENCHMARK_DATE = datetime.date(2025, 3, 1)
+
+app = typer.Typer()
+
+
+def get_benchmarks(fake: FakeElasticsearch, institutions: int, resources: int, projects: int, transfer_keys: int):
+    """
+    Set up the workloads and get the benchmarks that run them
+
+    :return: Map of benchmark name to a function running it once
+    """
+
+    transfer_key_groups = split_transfer_keys(synthetic.generate_transfer_keys(transfer_keys))
+    response = synthetic.generate_aggregation_response(institutions, resources, projects, transfer_key_groups.transfer_keys)
+    flat_records = flatten_aggregates(response, None, transfer_key_groups=transfer_key_groups)
+    summary_records = map_summary_records(flat_records, BENCHMARK_DATE)
+
+    # Full codes, broad and major only codes, unknown codes and projects without one
+    fos_mapper = FieldOfScienceMapper()
+    fos_ids = synthetic.FIELD_OF_SCIENCE_IDS + [x.split(".")[0] for x in synthetic.FIELD_OF_SCIENCE_IDS] + [x[:5] for x in synthetic.FIELD_OF_SCIENCE_IDS] + ["99.9999", None]
+
+    return {
+        "flatten_aggregates": lambda: flatten_aggregates(response, None, transfer_key_groups=transfer_key_groups),
+        "map_summary_records": lambda: map_summary_records(flat_records, BENCHMARK_DATE),
+        "map_id_to_fields_of_science": lambda: [fos_mapper.map_id_to_fields_of_science(fos_id) for fos_id in fos_ids],
+        "iter_bulk_chunks": lambda: sum(1 for _ in iter_bulk_chunks(summary_records, "ospool-summary", get_id=get_summary_record_id)),
+        "compare_summary_to_daily": lambda: compare_summary_to_daily(BENCHMARK_DATE, summary_records, fake.url),
+    }
+
+
+def time_benchmark(run, repeat: int, warmup: int = 1):
+    """Time a benchmark, returns the seconds of each timed run"""
+
+    for _ in range(warmup):
+        run()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def summarize_timings(timings: list):
+    """Get the statistical summary of a benchmark's timings in seconds"""
+
+    ordered = sorted(timings)
+
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * .95))],
+        "mean": statistics.mean(ordered),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+    }
+
+
+def get_machine():
+    """Describe the machine the benchmarks run on, baselines are only comparable on the same one"""
+
+    cpu = platform.processor()
+    try:
+        cpu = next(line.split(":", 1)[1].strip() for line in Path("/proc/cpuinfo").read_text().splitlines() if line.startswith("model name"))
+    except (IOError, StopIteration):
+        pass
+
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "processor": cpu, "cpus": os.cpu_count()}
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float):
+    """
+    Compare the medians of the results to the baseline
+
+    :return: Map of benchmark name to its median over the baseline median and if that is a regression
+    """
+
+    comparisons = {}
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = summary["median"] / baseline[name]["median"]
+        comparisons[name] = {"ratio": ratio, "regressed": ratio > 1 + tolerance}
+
+    return comparisons
+
+
+@app.command()
+def run(scale: str = "small", repeat: int = 5, only: list[str] = typer.Option(None), baseline: Path = BASELINE_FILE, save_baseline: bool = False, tolerance: float = .1):
+    """
+    Run the benchmarks and compare them to the baseline
+
+    :param scale: The workload size, one of small, medium or large
+    :param only: Run only these benchmarks
+    :param save_baseline: Save the results as the new baseline instead of comparing to it
+    :param tolerance: The fraction a median can be slower than the baseline before it is a regression
+    """
+
+    if scale not in SCALES:
+        print(f"[bold red]Unknown scale {scale}, use one of {', '.join(SCALES)}[/bold red]")
+        raise typer.Exit(code=1)
+
+    institutions, resources, projects, transfer_keys = SCALES[scale]
+
+    fake = FakeElasticsearch()
+    for path, response in synthetic.generate_topology(institutions, resources, projects).items():
+        fake.add_static(f"/institutions/{path}" if path.startswith("api/") else f"/topology/{path}", response)
+    fake.add_documents("daily_totals", [{"num_uniq_job_ids": 1, "all_cpu_hours": 1.0, "total_files_xferd": 1, "osdf_files_xferd": 1}], ids=[f"OSG-schedd-job-history_daily_{BENCHMARK_DATE}"])
+
+    results = {}
+    with fake:
+        os.environ["TOPOLOGY_HOST"] = fake.topology_url
+        os.environ["INSTITUTION_API_HOST"] = fake.institution_url
+        os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp()
+
+        print(f"[yellow]Running the {scale} benchmarks, {institutions * resources * projects} records with {transfer_keys} transfer keys[/yellow]")
+
+        # Keep the progress printed by the pipeline out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks = get_benchmarks(fake, institutions, resources, projects, transfer_keys)
+
+        for name, benchmark in benchmarks.items():
+            if only and name not in only:
+                continue
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = time_benchmark(benchmark, repeat)
+
+            results[name] = summarize_timings(timings)
+
+    baseline_results = {}
+    if baseline.exists():
+        baseline_json = json.loads(baseline.read_text())
+        baseline_results = baseline_json["results"].get(scale, {})
+
+        if not save_baseline and baseline_json.get("machine") != get_machine():
+            print(f"[yellow]{baseline} was measured on {baseline_json.get('machine')}, compare against a baseline saved on this machine to gate a change[/yellow]")
+
+    comparisons = compare_to_baseline(results, baseline_results, tolerance) if not save_baseline else {}
+
+    print(f"{'Benchmark'.ljust(28)}{'min':>10}{'median':>10}{'p95':>10}{'stdev':>10}{'vs base':>10}")
+    for name, summary in results.items():
+        row = name.ljust(28) + "".join(f"{summary[k] * 1000:>8.2f}ms" for k in ("min", "median", "p95", "stdev"))
+
+        if name in comparisons:
+            color = "red" if comparisons[name]["regressed"] else "green"
+            row += f"[{color}]{comparisons[name]['ratio']:>9.2f}x[/{color}]"
+
+        print(row)
+
+    if save_baseline:
+        baseline_json = json.loads(baseline.read_text()) if baseline.exists() else {"results": {}}
+        baseline_json["machine"] = get_machine()
+        baseline_json["results"][scale] = results
+        baseline.write_text(json.dumps(baseline_json, indent=2))
+
+        print(f"[green]Saved the {scale} baseline to {baseline}[/green]")
+        return
+
+    regressions = [name for name, comparison in comparisons.items() if comparison["regressed"]]
+    if regressions:
+        print(f"[bold red]Regressed more than {tolerance:.0%} against the baseline: {', '.join(regressions)}[/bold red]")
+        raise typer.Exit(code=1)
+
+    if not baseline_results:
+        print(f"[yellow]No {scale} baseline in {baseline}, save one with --save-baseline[/yellow]")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,192 @@
+"""
+Generates synthetic adstash data, aggregation responses shaped like the ones the summary query returns and the
+schedd documents, topology and daily reports a fake Elasticsearch can serve
+"""
+import datetime
+import random
+
+# Transfer protocols seen in the TransferInputStats and TransferOutputStats mappings
+TRANSFER_PROTOCOLS = ["OSDF", "Stash", "Http", "Https", "S3", "Pelican", "Cedar", "File", "Box", "Gdrive"]
+
+# SED-CIP codes given to the synthetic projects
+FIELD_OF_SCIENCE_IDS = ["11.0701", "26.0101", "40.0801", "14.0101", "45.0601", "27.0101", "51.2201", "40.0501"]
+
+# The collector every synthetic job ran in, so the jobs pass the OSPool filter
+SYNTHETIC_COLLECTOR_HOST = "cm-1.ospool.osg-htc.org"
+
+
+def generate_transfer_keys(n: int):
+    """Generate n transfer keys of the form found in the schedd index mappings"""
+
+    keys = []
+    i = 0
+    while len(keys) < n:
+        protocol = TRANSFER_PROTOCOLS[i % len(TRANSFER_PROTOCOLS)] + (str(i // len(TRANSFER_PROTOCOLS)) if i >= len(TRANSFER_PROTOCOLS) else "")
+        for stats in ("TransferInputStats", "TransferOutputStats"):
+            for suffix in ("FilesCountTotal", "SizeBytesTotal"):
+                keys.append(f"{stats}.{protocol}{suffix}")
+        i += 1
+
+    return set(keys[:n])
+
+
+def generate_aggregation_response(institutions: int, resources: int, projects: int, transfer_keys: set, seed: int = 0, key_density: float = .2):
+    """
+    Generate a nested institution -> resource -> project terms aggregation response
+
+    :param key_density: The fraction of the transfer keys present in each project bucket
+    """
+
+    rng = random.Random(seed)
+    transfer_keys = sorted(transfer_keys)
+
+    institution_buckets = []
+    for i in range(institutions):
+        resource_buckets = []
+        for r in range(resources):
+            project_buckets = []
+            for p in range(projects):
+                doc_count = rng.randint(1, 10000)
+                bucket = {
+                    "key": f"Project{p}",
+                    "doc_count": doc_count,
+                    "cpu_hours": {"value": doc_count * rng.random() * 4},
+                    "gpu_hours": {"value": doc_count * rng.random() if rng.random() < .1 else 0.0},
+                }
+                for key in rng.sample(transfer_keys, int(len(transfer_keys) * key_density)):
+                    bucket[key] = {"value": float(rng.randint(0, doc_count * (10 if "FilesCount" in key else 10 ** 9)))}
+
+                project_buckets.append(bucket)
+
+            project_buckets.sort(key=lambda b: (-b["doc_count"], b["key"]))
+            resource_buckets.append({
+                "key": f"Resource{i}-{r}",
+                "doc_count": sum(b["doc_count"] for b in project_buckets),
+                "acct_group": {"buckets": project_buckets}
+            })
+
+        resource_buckets.sort(key=lambda b: (-b["doc_count"], b["key"]))
+        institution_buckets.append({
+            "key": f"osg-htc.org_iid_{i:012x}",
+            "doc_count": sum(b["doc_count"] for b in resource_buckets),
+            "resources": {"buckets": resource_buckets}
+        })
+
+    institution_buckets.sort(key=lambda b: (-b["doc_count"], b["key"]))
+
+    return {
+        "took": 0,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": sum(b["doc_count"] for b in institution_buckets), "relation": "eq"}, "hits": []},
+        "aggregations": {"institution_id": {"buckets": institution_buckets}}
+    }
+
+
+def get_institution_id(i: int):
+    """The InstitutionID of synthetic institution i as it is found in the MachineAttrs"""
+
+    return f"osg-htc.org_iid_{i:012x}"
+
+
+def generate_schedd_documents(start: datetime.datetime, days: int, jobs_per_day: int, institutions: int, resources: int, projects: int, transfer_keys: set, seed: int = 0, key_density: float = .2):
+    """
+    Generate job documents spread over the days from start, one schedd index per day
+
+    Some jobs are missing their institution or one of the ResourceName attributes so every branch of the
+    ResourceName resolution is exercised.
+
+    :return: Map of index name to its documents
+    """
+
+    rng = random.Random(seed)
+    transfer_keys = sorted(transfer_keys)
+    start_timestamp = int(start.timestamp())
+
+    indices = {}
+    for day in range(days):
+        day_start = start_timestamp + day * 86400
+        documents = []
+        for _ in range(jobs_per_day):
+            i, r, p = rng.randrange(institutions), rng.randrange(resources), rng.randrange(projects)
+            resource_name = f"Resource{i}-{r}"
+
+            document = {
+                "RecordTime": day_start + rng.randrange(86400),
+                "JobUniverse": 5,
+                "ScheddName": f"ap{p % 4}.ospool.osg-htc.org",
+                "LastRemotePool": SYNTHETIC_COLLECTOR_HOST,
+                "ProjectName": f"Project{p}",
+                "CoreHr": rng.random() * 4,
+                "GpuCoreHr": rng.random() if rng.random() < .1 else 0.0,
+                "TransferInputStats": {},
+                "TransferOutputStats": {},
+            }
+            if rng.random() > .05:
+                document["MachineAttrOSG_INSTITUTION_ID0"] = get_institution_id(i)
+            if rng.random() > .1:
+                document["MachineAttrGLIDEIN_ResourceName0"] = resource_name
+            if rng.random() > .1:
+                document["MATCH_EXP_JOBGLIDEIN_ResourceName"] = resource_name
+
+            for key in rng.sample(transfer_keys, int(len(transfer_keys) * key_density)):
+                stats, stat = key.split(".", 1)
+                document[stats][stat] = rng.randint(0, 10 if "FilesCount" in key else 10 ** 9)
+
+            documents.append(document)
+
+        indices[f"osg-schedd-{datetime.datetime.fromtimestamp(day_start, datetime.timezone.utc):%Y.%m.%d}"] = documents
+
+    return indices
+
+
+def generate_topology(institutions: int, resources: int, projects: int):
+    """
+    Generate the Topology and Institution API responses matching the synthetic documents
+
+    :return: Map of URL path, relative to its API, to the JSON it returns
+    """
+
+    return {
+        "miscresource/json": {
+            f"Resource{i}-{r}": {"Name": f"Resource{i}-{r}", "Facility": f"Facility{i}", "ResourceGroup": f"Group{i}-{r}"}
+            for i in range(institutions) for r in range(resources)
+        },
+        "miscfacility/json": {
+            f"Facility{i}": {"InstitutionID": f"https://osg-htc.org/iid/{i:012x}"} for i in range(institutions)
+        },
+        "miscproject/json": {
+            f"Project{p}": {
+                "FieldOfScienceID": FIELD_OF_SCIENCE_IDS[p % len(FIELD_OF_SCIENCE_IDS)],
+                "InstitutionID": f"https://osg-htc.org/iid/{p % institutions:012x}"
+            }
+            for p in range(projects)
+        },
+        "api/institution_ids": [
+            {"id": f"https://osg-htc.org/iid/{i:012x}", "name": f"Institution {i}"} for i in range(institutions)
+        ],
+    }
+
+
+def generate_daily_totals(schedd_documents: dict, day_ranges: dict):
+    """
+    Generate the daily_totals reports of the synthetic jobs
+
+    :param day_ranges: Map of day to the (start, end) datetimes the day's report covers
+    :return: Map of document id to daily report
+    """
+
+    documents = [document for index_documents in schedd_documents.values() for document in index_documents]
+
+    daily_totals = {}
+    for day, (start, end) in day_ranges.items():
+        day_documents = [d for d in documents if start.timestamp() <= d["RecordTime"] < end.timestamp()]
+
+        file_counts = [(k, v) for d in day_documents for stats in ("TransferInputStats", "TransferOutputStats") for k, v in d[stats].items() if "FilesCountTotal" in k]
+        daily_totals[f"OSG-schedd-job-history_daily_{day}"] = {
+            "num_uniq_job_ids": len(day_documents),
+            "all_cpu_hours": sum(d["CoreHr"] for d in day_documents),
+            "total_files_xferd": sum(v for _, v in file_counts),
+            "osdf_files_xferd": sum(v for k, v in file_counts if "osdf" in k.casefold() or "stash" in k.casefold()),
+        }
+
+    return daily_totals
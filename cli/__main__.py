@@ -12,8 +12,10 @@ import typer
 
 from cli.delete_date import delete_date as delete_date_cli
 from cli.push_summary_date import push_summary_date
+from cli.rebuild_index import rebuild_index
 from cli.report_quality import report_quality as report_quality_cli
 from cli.validate_data import validate_data as validate_data_cli
+from summarize import metrics
 from util.send_email import send_email
 
 app = typer.Typer()
@@ -34,20 +36,23 @@ class Tee:
 
 
 @app.command()
-def delete(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False, force: bool = False):
+def delete(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False, force: bool = False, range_delete: bool = False, requests_per_second: float = None):
     """
     Deletes all documents for a given date or range
+
+    :param range_delete: Delete the range with one sliced background delete, polled until it finishes
+    :param requests_per_second: Throttle the range delete to this many documents a second
     """
 
     # Setup
     setup_logging(debug)
     load_env_file(env_file, "ES_USER", "ES_PASSWORD", "ES_HOST", "ES_INDEX")
 
-    delete_date_cli(date, os.environ['ES_HOST'], os.environ['ES_INDEX'], os.environ['ES_USER'], os.environ['ES_PASSWORD'], force, end=end)
+    delete_date_cli(date, os.environ['ES_HOST'], os.environ['ES_INDEX'], os.environ['ES_USER'], os.environ['ES_PASSWORD'], force, end=end, range_delete=range_delete, requests_per_second=requests_per_second)
 
 
 @app.command()
-def summarize(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False, force: bool = False, dry_run: bool = False, not_interactive: bool = False, regenerate: bool = False, send_failure_email: bool = False):
+def summarize(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False, force: bool = False, dry_run: bool = False, not_interactive: bool = False, regenerate: bool = False, send_failure_email: bool = False, days_per_query: int = 1, resource_name_script: bool = False, metrics_file: str = None, prometheus_file: str = None):
     """
     Summarizes and pushes the OSPool summary data for a given date
 
@@ -55,6 +60,11 @@ def summarize(date: datetime, end: Annotated[Optional[datetime], typer.Argument(
     :param env_file: The path to the environment file
     :param debug: Whether to enable debug logging
     :param force: Whether to force the push of the summary data if the data is off by more than 5%
+    :param regenerate: Overwrite the existing documents of the dates and delete the ones no longer in the summary
+    :param days_per_query: The number of days to pull from adstash in a single query
+    :param resource_name_script: Fall back to deriving the ResourceName with the painless runtime mapping
+    :param metrics_file: Path to write the timing of each stage to as JSON
+    :param prometheus_file: Path to write the timing of each stage to in the Prometheus textfile collector format
     """
 
     # Setup
@@ -72,12 +82,65 @@ def summarize(date: datetime, end: Annotated[Optional[datetime], typer.Argument(
     Everyday we summarize the previous day's data, every weekend we resummarize last years data in case mapped values have changed.
     """
 
-    # Capture stdout from the push_summary_date function
+    run_and_report(
+        lambda: push_summary_date(date, os.environ['ES_PROVIDER_HOST'], os.environ['ES_HOST'],  os.environ['ES_INDEX'], os.environ['ES_USER'], os.environ['ES_PASSWORD'], force, dry_run, not_interactive, regenerate, end, days_per_query, resource_name_script),
+        email_body,
+        send_failure_email,
+        metrics_file,
+        prometheus_file
+    )
+
+
+@app.command()
+def rebuild(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False, force: bool = False, not_interactive: bool = False, keep_old: bool = False, send_failure_email: bool = False, days_per_query: int = 1, resource_name_script: bool = False, metrics_file: str = None, prometheus_file: str = None):
+    """
+    Resummarizes a date range into a new generation of the summary index and swaps ES_INDEX onto it
+
+    :param date: The first date to resummarize
+    :param end: The last date to resummarize
+    :param env_file: The path to the environment file
+    :param debug: Whether to enable debug logging
+    :param force: Whether to force the push of the summary data if the data is off by more than 5%
+    :param keep_old: Keep the old generation index after the swap
+    :param days_per_query: The number of days to pull from adstash in a single query
+    :param resource_name_script: Fall back to deriving the ResourceName with the painless runtime mapping
+    :param metrics_file: Path to write the timing of each stage to as JSON
+    :param prometheus_file: Path to write the timing of each stage to in the Prometheus textfile collector format
+    """
+
+    # Setup
+    setup_logging(debug)
+    load_env_file(env_file, "ES_USER", "ES_PASSWORD", "ES_HOST", "ES_INDEX", "ES_PROVIDER_HOST")
+
+    email_body = f"""
+    Rebuild summary index {os.environ['ES_INDEX']} for {date} to {end if end else date}.
+
+    These summaries are the source of information of the OSPool webpages. If the rebuild fails {os.environ['ES_INDEX']}
+    is left untouched and keeps serving the previous generation.
+
+    These summaries are completed by the image found at git@github.com:osg-htc/ospool-summary.git/images/summarize_yesterday:latest.
+
+    Everyday we summarize the previous day's data, every weekend we resummarize last years data in case mapped values have changed.
+    """
+
+    run_and_report(
+        lambda: rebuild_index(date, os.environ['ES_PROVIDER_HOST'], os.environ['ES_HOST'], os.environ['ES_INDEX'], os.environ['ES_USER'], os.environ['ES_PASSWORD'], force, not_interactive, end, days_per_query, resource_name_script, keep_old),
+        email_body,
+        send_failure_email,
+        metrics_file,
+        prometheus_file
+    )
+
+
+def run_and_report(run, email_body: str, send_failure_email: bool = False, metrics_file: str = None, prometheus_file: str = None):
+    """Run a push, emailing its output on success and on failure if requested, and export its metrics"""
+
+    # Capture stdout from the push
     captured_output = StringIO()
     sys.stdout = Tee(sys.stdout, captured_output)
 
     try:
-        push_summary_date(date, os.environ['ES_PROVIDER_HOST'], os.environ['ES_HOST'],  os.environ['ES_INDEX'], os.environ['ES_USER'], os.environ['ES_PASSWORD'], force, dry_run, not_interactive, regenerate, end)
+        run()
 
         output_text = captured_output.getvalue()
 
@@ -105,6 +168,11 @@ def summarize(date: datetime, end: Annotated[Optional[datetime], typer.Argument(
     finally:
         captured_output.close()
 
+        if metrics_file is not None:
+            metrics.export_json(metrics_file)
+        if prometheus_file is not None:
+            metrics.export_prometheus(prometheus_file)
+
 
 @app.command()
 def validate(date: datetime, end: Annotated[Optional[datetime], typer.Argument()] = None, env_file: str = None, debug: bool = False):
@@ -1,16 +1,26 @@
 
+import asyncio
 import os
 from datetime import date, datetime, timedelta
 
 import typer
 from rich import print
 
-from cli.util import get_current_date_count
-from summarize.es import search, delete_by_query
+from cli.util import get_current_date_counts, get_date_range_query, get_date_counts
+from summarize import es_async
+from summarize.es import delete_by_query, delete_by_query_task
 
 
-def delete_date(date: datetime, host, index, username: str, password: str, force: bool = False, end: datetime = None):
-    """Delete all documents for a given date or range"""
+def delete_date(date: datetime, host, index, username: str, password: str, force: bool = False, end: datetime = None, range_delete: bool = False, requests_per_second: float = None):
+    """
+    Delete all documents for a given date or range
+
+    :param range_delete: Delete the whole range with one sliced background delete instead of one delete per date
+    :param requests_per_second: Throttle the range delete to this many documents a second
+    """
+
+    if range_delete:
+        return delete_date_range(date, host, index, username, password, force, end, requests_per_second)
 
     dates_to_validate = [date.date()]
     if end is not None:
@@ -23,37 +33,109 @@ def delete_date(date: datetime, host, index, username: str, password: str, force
             dates_to_validate.append(i)
             i += timedelta(days=1)
 
-    for date in dates_to_validate:
-
-        date_document_count = get_current_date_count(date, host, index, username, password)
+    date_document_counts = asyncio.run(get_current_date_counts(dates_to_validate, host, index, username, password))
 
+    for date in dates_to_validate:
         confirmed = force or typer.confirm(
-            f"Confirm deletion of {date_document_count} documents from {index} on date {date}?"
+            f"Confirm deletion of {date_document_counts[date]} documents from {index} on date {date}?"
         )
 
         if not confirmed:
             raise typer.Exit()
 
-        date = datetime.combine(date, datetime.min.time())
+    # Delete every date concurrently
+    results = asyncio.run(delete_dates(dates_to_validate, host, index, username, password))
+
+    failed = False
+    for date, result in zip(dates_to_validate, results):
+        if isinstance(result, Exception):
+            print(f"[bold red]Failed to delete documents on {date}: {result}[/bold red]")
+            failed = True
+        else:
+            print(f"[green]Deleted {date_document_counts[date]} documents from {date}![/green]")
+
+    if failed:
+        raise typer.Exit(code=1)
 
-        query = {
-            "query": {
-                "range": {
-                    "Date": {
-                        "gte": date.isoformat(),
-                        "lt": (date + timedelta(seconds=1)).isoformat()
+
+def delete_date_range(date: datetime, host, index, username: str, password: str, force: bool = False, end: datetime = None, requests_per_second: float = None):
+    """Delete all documents from date through end with one _delete_by_query over the range"""
+
+    start_date = min(date.date(), (end or date).date())
+    end_date = max(date.date(), (end or date).date())
+
+    range_query = get_date_range_query(start_date, end_date)
+
+    # One date histogram gives the counts of every date for the prompt
+    date_document_counts = get_date_counts(range_query, host, index, username, password)
+    total = sum(date_document_counts.values())
+
+    for date, count in sorted(date_document_counts.items()):
+        print(f"[yellow]{date}: {count} documents[/yellow]")
+
+    if total == 0:
+        print(f"[yellow]No documents in {index} from {start_date} to {end_date}[/yellow]")
+        return
+
+    confirmed = force or typer.confirm(
+        f"Confirm deletion of {total} documents from {index} on {len(date_document_counts)} dates from {start_date} to {end_date}?"
+    )
+
+    if not confirmed:
+        raise typer.Exit()
+
+    def print_progress(status: dict):
+        print(f"[yellow]Deleted {status.get('deleted', 0)}/{status.get('total', 0)} documents[/yellow]")
+
+    try:
+        deleted = delete_by_query_task(range_query, host, index, username, password, requests_per_second, progress=print_progress)
+    except Exception as e:
+        print(f"[bold red]Failed to delete documents from {start_date} to {end_date}: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+    print(f"[green]Deleted {deleted} documents from {start_date} to {end_date}![/green]")
+
+
+async def delete_dates(dates: list, host: str, index: str, username: str, password: str):
+    """Delete all documents on each date, returns the response or exception of each date"""
+
+    return await asyncio.gather(*(
+        es_async.delete_by_query(get_date_range_query(date, date), host, index, username, password) for date in dates
+    ), return_exceptions=True)
+
+
+def delete_stale_date_documents(date: date, ids: list, host: str, index: str, username: str, password: str):
+    """
+    Delete the documents on a date whose id is not in ids
+
+    :return: The number of documents deleted
+    """
+
+    date = datetime.combine(date, datetime.min.time())
+
+    query = {
+        "query": {
+            "bool": {
+                "filter": {
+                    "range": {
+                        "Date": {
+                            "gte": date.isoformat(),
+                            "lt": (date + timedelta(seconds=1)).isoformat()
+                        }
+                    }
+                },
+                "must_not": {
+                    "ids": {
+                        "values": ids
                     }
                 }
             }
         }
+    }
 
-        try:
-            delete_by_query(query, host, index, username, password)
-        except Exception as e:
-            print(f"[bold red]Failed to delete documents: {e}[/bold red]")
-            raise typer.Exit(code=1)
-        else:
-            print(f"[green]Deleted {date_document_count} documents from {date}![/green]")
+    response = delete_by_query(query, host, index, username, password)
+
+    return response["deleted"]
 
 
 if __name__ == "__main__":
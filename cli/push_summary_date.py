@@ -1,4 +1,5 @@
 
+import asyncio
 import pytz
 import os
 from datetime import date, datetime, timedelta, timezone
@@ -6,15 +7,22 @@ from datetime import date, datetime, timedelta, timezone
 import typer
 from rich import print
 
-from cli.delete_date import delete_date
-from cli.util import get_current_date_count
-from summarize import get_summary_records
+from cli.delete_date import delete_stale_date_documents
+from cli.util import get_current_date_counts
+from summarize import es_async
+from summarize.main import get_summary_records, get_summary_records_by_day, get_summary_record_id
 from summarize.es import index_documents
+from summarize.metrics import span
 from summarize.validate import compare_summary_to_daily
 
 
-def push_summary_date(date: datetime, provider_host: str, host: str, index: str, username: str, password: str, force: bool = False, dry_run: bool = False, not_interactive: bool = False, regenerate: bool = False, end: datetime = None):
-    """Get yesterday's summary records and index them into Elasticsearch"""
+def push_summary_date(date: datetime, provider_host: str, host: str, index: str, username: str, password: str, force: bool = False, dry_run: bool = False, not_interactive: bool = False, regenerate: bool = False, end: datetime = None, days_per_query: int = 1, resource_name_script: bool = False):
+    """
+    Get yesterday's summary records and index them into Elasticsearch
+
+    :param days_per_query: The number of days to pull from adstash in each query
+    :param resource_name_script: Derive the ResourceName with the painless runtime mapping
+    """
 
     print(f"[yellow]Pushing summary data for {date} with tz {date.tzinfo}[/yellow]")
 
@@ -29,72 +37,125 @@ def push_summary_date(date: datetime, provider_host: str, host: str, index: str,
             dates_to_validate.append(i)
             i += timedelta(days=1)
 
-    for date in dates_to_validate:
+    # Check existing summary documents state for every date up front, before anything is pulled
+    date_document_counts = asyncio.run(get_current_date_counts(dates_to_validate, host, index, username, password))
+    if not dry_run and not regenerate:
+        for date in dates_to_validate:
+            if date_document_counts[date] > 0:
+                print(f"[bold red]Documents already exist for {date}, please delete before updating[/bold red]")
+                raise typer.Exit(code=1)
 
-        # Check existing summary documents state for the date
-        date_document_count = get_current_date_count(date, host, index, username, password)
-        if date_document_count > 0 and not dry_run and not regenerate:
-            print(f"[bold red]Documents already exist for {date}, please delete before updating[/bold red]")
-            raise typer.Exit(code=1)
+    # Batches of days pulled from adstash in one query each
+    batches = [
+        {day: get_central_day_range(day) for day in dates_to_validate[i:i + days_per_query]}
+        for i in range(0, len(dates_to_validate), days_per_query)
+    ]
 
-        # Get the start of the day in Central Time
-        start_time = datetime.combine(date, datetime.min.time()).astimezone(pytz.utc)
-        end_time = start_time + timedelta(days=1)
+    # Pull and compare a window of batches concurrently, then index its days in order before pulling the next
+    window = es_async.get_concurrency()
+    for i in range(0, len(batches), window):
+        for day_ranges in batches[i:i + window]:
+            for day, (start_central_time, end_central_time) in day_ranges.items():
+                print(f"[yellow]Getting summary records for central times {start_central_time} to {end_central_time}[/yellow]")
 
-        print(f"[yellow]Getting summary records for times {start_time} to {end_time}[/yellow]")
+        day_summaries = {}
+        for batch_summaries in asyncio.run(get_day_summaries(batches[i:i + window], provider_host, resource_name_script)):
+            day_summaries.update(batch_summaries)
 
-        # To keep things consistent with the reports convert to central time
-        start_central_time = start_time.astimezone(pytz.timezone('America/Chicago'))
-        end_central_time = end_time.astimezone(pytz.timezone('America/Chicago'))
+        for date, (summary_records, comparison) in day_summaries.items():
+            with span("day", date=date):
+                index_day_summary(date, summary_records, comparison, host, index, username, password, force, dry_run, not_interactive, regenerate)
 
-        # Get the summary records
-        print(f"[yellow]Getting summary records for central times {start_central_time} to {end_central_time}[/yellow]")
-        summary_records = get_summary_records(start=start_central_time, end=end_central_time, host=provider_host)
 
-        comparison = compare_summary_to_daily(date, summary_records, provider_host)
-        max_diff = max([comparison[x] for x in comparison.keys() if "Vs" in x])
+async def get_day_summaries(batches: list, provider_host: str, resource_name_script: bool = False):
+    """Pull and compare the batches of days concurrently, up to ES_CONCURRENCY at once"""
 
-        pretty_dictionary = '\n'.join([f"{k}: {v}" for k, v in comparison.items()])
+    return await asyncio.gather(*(
+        es_async.run(get_batch_summaries, day_ranges, provider_host, resource_name_script) for day_ranges in batches
+    ))
 
-        # If we are off by > 5% then we should not push the data
-        if max_diff > .1:
-            print(f"[bold red]Data for {date} is off daily reports by {max_diff}%[/bold red]")
-            print(f"[bold red]{pretty_dictionary}[/bold red]")
 
-            # If not forcing via cli, ask for confirmation if you want to force
-            if not force and not dry_run:
+def get_batch_summaries(day_ranges: dict, provider_host: str, resource_name_script: bool = False):
+    """
+    Get the summary records of a batch of days and compare each day to the daily reports
 
-                # If interactive and user opts in
-                if not not_interactive and typer.confirm("Index these documents despite warnings?", default=False):
-                    print(f"[yellow]Force indexing {len(summary_records)} documents on {date}[/yellow]")
+    :param day_ranges: Map of day to the (start, end) datetimes the day spans
+    :return: Map of day to its summary records and comparison
+    """
 
-                else:
-                    print(f"[bold red]Aborting indexing documents for {date}[/bold red]")
-                    continue
+    with span("fetch", date=min(day_ranges)):
 
+        # A single day keeps the plain summary query, the per day aggregate is only worth it across days
+        if len(day_ranges) == 1:
+            (day, (start, end)), = day_ranges.items()
+            day_summary_records = {day: get_summary_records(start, end, host=provider_host, resource_name_script=resource_name_script)}
         else:
-            print(f"[green]{pretty_dictionary}[/green]\n")
-
-        # If we are regenerating then we need to delete the days records before indexing them
-        if regenerate and not dry_run:
-            delete_date(
-                date=datetime.combine(date, datetime.min.time()),
-                host=host,
-                index=index,
-                username=username,
-                password=password,
-                force=force or not_interactive
-            )
-
-        # Index the summary records
-        if not dry_run:
-            try:
-                index_documents(summary_records, host, index, username, password)
-            except Exception as e:
-                print(f"[bold red]Failed to index documents[/bold red]")
-                raise e
+            day_summary_records = get_summary_records_by_day(day_ranges, host=provider_host, resource_name_script=resource_name_script)
+
+        return {day: (summary_records, compare_summary_to_daily(day, summary_records, provider_host)) for day, summary_records in day_summary_records.items()}
+
+
+def index_day_summary(date: date, summary_records: list, comparison: dict, host: str, index: str, username: str, password: str, force: bool = False, dry_run: bool = False, not_interactive: bool = False, regenerate: bool = False):
+    """Index the summary records of a day if they agree with the daily reports, or the push is forced"""
+
+    max_diff = max([comparison[x] for x in comparison.keys() if "Vs" in x])
+
+    pretty_dictionary = '\n'.join([f"{k}: {v}" for k, v in comparison.items()])
+
+    # If we are off by > 5% then we should not push the data
+    if max_diff > .1:
+        print(f"[bold red]Data for {date} is off daily reports by {max_diff}%[/bold red]")
+        print(f"[bold red]{pretty_dictionary}[/bold red]")
+
+        # If not forcing via cli, ask for confirmation if you want to force
+        if not force and not dry_run:
+
+            # If interactive and user opts in
+            if not not_interactive and typer.confirm("Index these documents despite warnings?", default=False):
+                print(f"[yellow]Force indexing {len(summary_records)} documents on {date}[/yellow]")
+
             else:
-                print(f"[green]Indexed {len(summary_records)} documents![/green]")
+                print(f"[bold red]Aborting indexing documents for {date}[/bold red]")
+                return
+
+    else:
+        print(f"[green]{pretty_dictionary}[/green]\n")
+
+    # Index the summary records, the ids are deterministic so regenerated documents overwrite the old ones
+    if not dry_run:
+        try:
+            index_documents(summary_records, host, index, username, password, get_id=get_summary_record_id)
+        except Exception as e:
+            print(f"[bold red]Failed to index documents[/bold red]")
+            raise e
+        else:
+            print(f"[green]Indexed {len(summary_records)} documents![/green]")
+
+    # If we are regenerating then remove the documents that are no longer in the summary
+    if regenerate and not dry_run:
+        stale_count = delete_stale_date_documents(
+            date,
+            [get_summary_record_id(record) for record in summary_records],
+            host,
+            index,
+            username,
+            password
+        )
+        print(f"[green]Deleted {stale_count} stale documents from {date}[/green]")
+
+
+def get_central_day_range(date: date):
+    """Get the start and end of a day in Central Time, to keep things consistent with the daily reports"""
+
+    # Get the start of the day in Central Time
+    start_time = datetime.combine(date, datetime.min.time()).astimezone(pytz.utc)
+    end_time = start_time + timedelta(days=1)
+
+    # To keep things consistent with the reports convert to central time
+    start_central_time = start_time.astimezone(pytz.timezone('America/Chicago'))
+    end_central_time = end_time.astimezone(pytz.timezone('America/Chicago'))
+
+    return start_central_time, end_central_time
 
 
 if __name__ == "__main__":
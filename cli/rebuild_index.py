@@ -0,0 +1,157 @@
+import os
+from datetime import datetime, timedelta
+
+import typer
+from rich import print
+
+from cli.push_summary_date import push_summary_date
+from cli.util import get_date_range_query, get_date_counts
+from summarize.es import create_index, get_index, update_index_settings, refresh_index, reindex, count, update_aliases, delete_index, wait_for_index_health
+from summarize.metrics import span
+
+
+def rebuild_index(date: datetime, provider_host: str, host: str, alias: str, username: str, password: str, force: bool = False, not_interactive: bool = False, end: datetime = None, days_per_query: int = 1, resource_name_script: bool = False, keep_old: bool = False):
+    """
+    Rebuild the summary index for a date range into a new generation index and swap the alias onto it
+
+    The new generation is bulk loaded with no replicas and refreshes turned off while the live index keeps serving.
+    Documents outside the range are copied over as they are, days that fail to summarize keep their old documents.
+    Once the generation is validated and its replicas are allocated the alias is moved to it in one atomic action and
+    the old generation is dropped.
+
+    :param alias: The alias the OSPool webpages read from, if it is still a concrete index it is replaced by the alias
+    :param keep_old: Keep the old generation index after the swap, not possible if alias is a concrete index
+    """
+
+    start_date = min(date.date(), (end or date).date())
+    end_date = max(date.date(), (end or date).date())
+
+    # Find the indices currently behind the alias
+    current_indices = get_index(host, alias, username, password)
+    is_concrete = alias in current_indices
+
+    generation = f"{alias}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    print(f"[yellow]Rebuilding {alias} ({', '.join(current_indices) or 'empty'}) into {generation}[/yellow]")
+
+    # Copy the mappings and replica count of the current generation
+    mappings = {}
+    replicas = "1"
+    if current_indices:
+        latest_index = current_indices[max(current_indices)]
+        mappings = latest_index["mappings"]
+        replicas = latest_index["settings"]["index"].get("number_of_replicas", replicas)
+
+    create_index(host, generation, username, password, body={
+        "settings": {"index": {"number_of_replicas": 0, "refresh_interval": "-1"}},
+        "mappings": mappings
+    })
+
+    range_query = get_date_range_query(start_date, end_date)
+    outside_range_query = {"query": {"bool": {"must_not": range_query["query"]}}}
+
+    try:
+        with span("rebuild", index=generation):
+
+            # Carry over everything outside the rebuilt range
+            if current_indices:
+                copied = reindex(outside_range_query, host, alias, generation, username, password)
+                print(f"[green]Copied {copied} documents outside {start_date} to {end_date} into {generation}[/green]")
+
+            push_summary_date(
+                datetime.combine(start_date, datetime.min.time()),
+                provider_host,
+                host,
+                generation,
+                username,
+                password,
+                force=force,
+                not_interactive=not_interactive,
+                end=datetime.combine(end_date, datetime.min.time()),
+                days_per_query=days_per_query,
+                resource_name_script=resource_name_script
+            )
+            refresh_index(host, generation, username, password)
+
+            # Days that were not pushed keep the documents they have now
+            if current_indices:
+                old_date_counts = get_date_counts(range_query, host, alias, username, password)
+                new_date_counts = get_date_counts(range_query, host, generation, username, password)
+
+                for missing_date in sorted(set(old_date_counts) - set(new_date_counts)):
+                    print(f"[yellow]Keeping the {old_date_counts[missing_date]} existing documents for {missing_date}[/yellow]")
+                    reindex(get_date_range_query(missing_date, missing_date), host, alias, generation, username, password)
+
+                refresh_index(host, generation, username, password)
+
+            validate_generation(host, alias, generation, current_indices, range_query, outside_range_query, username, password)
+
+    except (Exception, typer.Exit) as e:
+        print(f"[bold red]Failed to rebuild {alias}, deleting {generation}[/bold red]")
+
+        # Keep the rebuild failure as the error, not a failure to clean up after it
+        try:
+            delete_index(host, generation, username, password)
+        except Exception as delete_error:
+            print(f"[bold red]Could not delete {generation}, delete it by hand: {delete_error}[/bold red]")
+
+        raise e
+
+    # Bring the generation up to the serving settings before it takes traffic
+    update_index_settings(host, generation, {"number_of_replicas": replicas, "refresh_interval": None}, username, password)
+
+    # The old generation goes away with the swap, so the new one must have its replicas allocated first
+    try:
+        wait_for_index_health(host, generation, "green", username=username, password=password)
+    except Exception as e:
+        print(f"[bold red]Aborting, {generation} did not go green and is left in place: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+    if not (force or not_interactive) and not typer.confirm(f"Swap {alias} onto {generation}?"):
+        print(f"[bold red]Aborting, {generation} is left in place[/bold red]")
+        raise typer.Exit()
+
+    # Move the alias in one atomic action, a concrete index in the way is deleted by the same action
+    actions = [{"add": {"index": generation, "alias": alias}}]
+    if is_concrete:
+        actions.append({"remove_index": {"index": alias}})
+    else:
+        actions.extend({"remove": {"index": index, "alias": alias}} for index in current_indices)
+
+    update_aliases(host, actions, username, password)
+    print(f"[green]Swapped {alias} onto {generation}[/green]")
+
+    if not is_concrete and not keep_old:
+        for index in current_indices:
+            delete_index(host, index, username, password)
+            print(f"[green]Deleted old generation {index}[/green]")
+
+
+def validate_generation(host: str, alias: str, generation: str, current_indices: dict, range_query: dict, outside_range_query: dict, username: str, password: str):
+    """Check the new generation has every document outside the range and a document on every date the alias has"""
+
+    if not current_indices:
+        return
+
+    old_outside_count = count(outside_range_query, host, alias, username, password)
+    new_outside_count = count(outside_range_query, host, generation, username, password)
+    if old_outside_count != new_outside_count:
+        raise Exception(f"{generation} has {new_outside_count} documents outside the rebuilt range, {alias} has {old_outside_count}")
+
+    missing_dates = set(get_date_counts(range_query, host, alias, username, password)) - set(get_date_counts(range_query, host, generation, username, password))
+    if missing_dates:
+        raise Exception(f"{generation} is missing documents on {', '.join(map(str, sorted(missing_dates)))}")
+
+    print(f"[green]Validated {generation}[/green]")
+
+
+if __name__ == "__main__":
+    """Used for debugging"""
+    rebuild_index(
+        datetime.now() - timedelta(days=7),
+        os.environ['ES_PROVIDER_HOST'],
+        os.environ['ES_HOST'],
+        os.environ['ES_INDEX'],
+        os.environ['ES_USER'],
+        os.environ['ES_PASSWORD'],
+        end=datetime.now() - timedelta(days=1)
+    )
@@ -9,16 +9,19 @@ from rich import print
 from cli.util import get_current_date_count
 from summarize.es import search, delete_by_query
 
+# The total, the metric sums and the unmapped names are all the report reads
+REPORT_FILTER_PATH = ["hits.total.value", "aggregations.*.value", "aggregations.*.buckets.key"]
+
 
 def report_quality(host, index):
     """Print out a pretty report on the quality of the data for a given date"""
 
     total_query = get_query(None)
-    total_response = search(total_query, host, index)
+    total_response = search(total_query, host, index, filter_path=["aggregations.*.value"])
 
     project_query = get_query("Project")
 
-    project_response = search(project_query, host, index)
+    project_response = search(project_query, host, index, filter_path=REPORT_FILTER_PATH)
 
     if project_response['hits']['total']['value'] == 0:
         print("[bold green]All Projects Mapped[/bold green]")
@@ -27,7 +30,7 @@ def report_quality(host, index):
         print(f"[bold red]{print_unmapped_resource_information(project_response, total_response, 'ProjectNames')}[/bold red]")
 
     resource_query = get_query("Resource")
-    resource_response = search(resource_query, host, index)
+    resource_response = search(resource_query, host, index, filter_path=REPORT_FILTER_PATH)
 
     if resource_response['hits']['total']['value'] == 0:
         print("[bold green]All Resources Mapped[/bold green]")
@@ -49,7 +52,7 @@ def print_unmapped_resource_information(term_response, total_response, term_key:
 
     max_key_length = max([len(k) for k in agg_keys])
 
-    term_key_values = [x['key'] for x in term_response['aggregations'][term_key]['buckets']]
+    term_key_values = [x['key'] for x in term_response['aggregations'].get(term_key, {}).get('buckets', [])]
 
     if len(term_key_values) == 0:
         return ""
@@ -15,7 +15,7 @@ def report(host, index):
     """Print out a pretty report on the quality of the data for a given date"""
 
     query = get_query()
-    response = search(query, host, index)
+    response = search(query, host, index, filter_path=["aggregations.ProjectName.buckets"])
 
     df = es_response_to_df(response)
 
@@ -1,16 +1,46 @@
+import asyncio
 from datetime import datetime, timedelta
 import os
 
-from summarize.es import search
+from summarize import es_async
+from summarize.es import search, search_after, SEARCH_AFTER_PAGE_SIZE
 
 
-def get_date_summary_records(date: datetime.date, host: str, index: str, username: str, password: str):
+def get_date_summary_records(date: datetime.date, host: str, index: str, username: str, password: str, source: list = None):
     """Get all records for a given date"""
 
+    return [record for batch in iter_summary_record_batches(date, date, host, index, username, password, source) for record in batch]
+
+
+def iter_summary_records(start: datetime.date, end: datetime.date, host: str, index: str, username: str, password: str, source: list = None):
+    """Yield the records from the start date through the end date one at a time"""
+
+    for batch in iter_summary_record_batches(start, end, host, index, username, password, source):
+        yield from batch
+
+
+def iter_summary_record_batches(start: datetime.date, end: datetime.date, host: str, index: str, username: str, password: str, source: list = None, batch_size: int = SEARCH_AFTER_PAGE_SIZE):
+    """
+    Yield the records from the start date through the end date in batches, paging with a point in time
+
+    :param source: The fields of the records to fetch, all of them if None
+    :param batch_size: The number of records in each batch
+    """
+
+    query = get_date_range_query(start, end)
+    if source is not None:
+        query["_source"] = source
+
+    for hits in search_after(query, host, index, username, password, page_size=batch_size):
+        yield [hit['_source'] for hit in hits]
+
+
+def get_current_date_count(date: datetime.date, host: str, index: str, username: str, password: str):
+    """Get current # of documents ingested on a date"""
+
     date = datetime.combine(date, datetime.min.time())
 
     query = {
-        "size": 10000,
         "query": {
             "range": {
                 "Date": {
@@ -21,36 +51,70 @@ def get_date_summary_records(date: datetime.date, host: str, index: str, usernam
         }
     }
 
-    data = search(query, host, index, username, password)
+    count_query = {
+        "track_total_hits": True,
+        "size": 0,
+        **query
+    }
 
-    return [x['_source'] for x in data['hits']['hits']]
+    data = search(count_query, host, index, username, password, filter_path=["hits.total.value"])
 
+    return data['hits']['total']['value']
 
-def get_current_date_count(date: datetime.date, host: str, index: str, username: str, password: str):
-    """Get current # of documents ingested on a date"""
 
-    date = datetime.combine(date, datetime.min.time())
+async def get_current_date_counts(dates: list, host: str, index: str, username: str, password: str):
+    """Get current # of documents ingested on each date, counting the dates concurrently"""
 
-    query = {
+    counts = await asyncio.gather(*(
+        es_async.count(get_date_range_query(date, date), host, index, username, password) for date in dates
+    ))
+
+    return dict(zip(dates, counts))
+
+
+def get_date_range_query(start: datetime.date, end: datetime.date):
+    """Get the query matching the documents from the start date through the end date"""
+
+    start = datetime.combine(start, datetime.min.time())
+    end = datetime.combine(end, datetime.min.time())
+
+    return {
         "query": {
             "range": {
                 "Date": {
-                    "gte": date.isoformat(),
-                    "lt": (date + timedelta(seconds=1)).isoformat()
+                    "gte": start.isoformat(),
+                    "lt": (end + timedelta(days=1)).isoformat()
                 }
             }
         }
     }
 
+
+def get_date_counts(query: dict, host: str, index: str, username: str, password: str):
+    """Get the # of documents on each date with documents matching the query"""
+
     count_query = {
-        "track_total_hits": True,
         "size": 0,
-        **query
+        "track_total_hits": True,
+        **query,
+        "aggs": {
+            "dates": {
+                "date_histogram": {
+                    "field": "Date",
+                    "calendar_interval": "day",
+                    "min_doc_count": 1,
+                    "format": "yyyy-MM-dd"
+                }
+            }
+        }
     }
 
-    data = search(count_query, host, index, username, password)
+    data = search(count_query, host, index, username, password, filter_path=["aggregations.dates.buckets.key_as_string", "aggregations.dates.buckets.doc_count"])
 
-    return data['hits']['total']['value']
+    # Empty buckets are dropped by the filter_path along with their parents
+    buckets = data.get('aggregations', {}).get('dates', {}).get('buckets', [])
+
+    return {datetime.strptime(b['key_as_string'], "%Y-%m-%d").date(): b['doc_count'] for b in buckets}
 
 
 if __name__ == "__main__":
@@ -1,12 +1,13 @@
 
+import asyncio
 import os
 from datetime import date, datetime, timedelta, timezone
 
 import typer
 from rich import print
 
-from cli.util import get_current_date_count, get_date_summary_records
-from summarize import get_summary_records
+from cli.util import get_current_date_count, iter_summary_records
+from summarize import get_summary_records, es_async
 from summarize.es import index_documents
 from summarize.validate import compare_summary_to_daily, daily_record_mapping, calculate_percent_difference
 
@@ -25,12 +26,11 @@ def validate_data(date: datetime, provider_host: str, host: str, index: str, use
             dates_to_validate.append(i)
             i += timedelta(days=1)
 
-    comparisons = []
-    for date in dates_to_validate:
+    # Pull and compare every date concurrently
+    date_comparisons = asyncio.run(get_date_comparisons(dates_to_validate, provider_host, host, index, username, password))
 
-        # Check existing summary documents state for the date
-        summary_records = get_date_summary_records(date, host, index, username, password)
-        comparison = compare_summary_to_daily(date, summary_records, provider_host)
+    comparisons = []
+    for date, comparison in zip(dates_to_validate, date_comparisons):
         max_diff = max([comparison[x] for x in comparison.keys() if "Vs" in x])
 
         pretty_dictionary = '\n'.join([f"{k}: {v}" for k, v in comparison.items()])
@@ -85,6 +85,17 @@ def validate_data(date: datetime, provider_host: str, host: str, index: str, use
             print(f"[green]{pretty_dictionary}[/green]\n")
 
 
+async def get_date_comparisons(dates: list, provider_host: str, host: str, index: str, username: str, password: str):
+    """Compare the stored summary records of each date to its daily report, overlapping the dates"""
+
+    async def get_date_comparison(date):
+        # Stream only the compared fields of the records, the pages are pulled as the comparison sums them
+        summary_records = iter_summary_records(date, date, host, index, username, password, source=list(daily_record_mapping.values()))
+        return await es_async.run(compare_summary_to_daily, date, summary_records, provider_host)
+
+    return await asyncio.gather(*(get_date_comparison(date) for date in dates))
+
+
 if __name__ == "__main__":
     """Used for debugging"""
     validate_data(
@@ -1,3 +1,3 @@
 #!/usr/bin/env bash
 
-python3 -m cli summarize --send-failure-email --regenerate --not-interactive $(date -d "1 year ago" +%Y-%m-%d) $(date -d "yesterday" +%Y-%m-%d)
+python3 -m cli rebuild --send-failure-email --not-interactive --days-per-query 7 $(date -d "1 year ago" +%Y-%m-%d) $(date -d "yesterday" +%Y-%m-%d)
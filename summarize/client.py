@@ -0,0 +1,138 @@
+"""
+Shared HTTP client for Elasticsearch, Topology and the Institution API
+
+Every call goes through one requests.Session per set of credentials, so connections are kept alive and pooled per
+host instead of paying a TCP/TLS handshake for every small count or lookup. Requests get a default timeout and are
+retried with exponential backoff and jitter when the server answers 429 or 5xx or the connection fails.
+
+The defaults can be overridden with the environment variables below.
+"""
+import base64
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# The defaults below are overridden by their environment variables, read when a session is created so the
+# variables loaded from an --env-file apply
+
+# Number of connections kept alive per host, raise it when running more threads than this against one host
+POOL_MAXSIZE = 16  # HTTP_POOL_MAXSIZE
+
+# Number of hosts a session keeps a pool for
+POOL_CONNECTIONS = 8  # HTTP_POOL_CONNECTIONS
+
+# Number of times a request is retried, the wait before retry n is backoff * 2^(n-1) plus up to jitter seconds
+RETRIES = 5  # HTTP_RETRIES
+RETRY_BACKOFF = 1  # HTTP_RETRY_BACKOFF
+RETRY_BACKOFF_MAX = 60  # HTTP_RETRY_BACKOFF_MAX
+RETRY_JITTER = 1  # HTTP_RETRY_JITTER
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Seconds to wait for a connection and between bytes of a response, the adstash aggregations can take minutes
+CONNECT_TIMEOUT = 10  # HTTP_CONNECT_TIMEOUT
+READ_TIMEOUT = 600  # HTTP_READ_TIMEOUT
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies a default timeout to requests that don't set their own"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout if timeout is not None else get_timeout()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        return super().send(request, **kwargs)
+
+
+def get_timeout():
+    """Get the default (connect, read) timeout of the shared sessions"""
+
+    return float(os.environ.get("HTTP_CONNECT_TIMEOUT", CONNECT_TIMEOUT)), float(os.environ.get("HTTP_READ_TIMEOUT", READ_TIMEOUT))
+
+
+def get_retry():
+    """
+    Get the retry policy of the shared sessions
+
+    POST is retried along with the idempotent methods, as most Elasticsearch reads (_count, _msearch, search_after)
+    and task submissions are POSTs and a 429 means the request was never processed. _bulk sends its writes over a
+    session without retries, see get_session, as it resends the rejected items itself. The response of the last
+    attempt is returned rather than raised so callers can log it.
+    """
+
+    return Retry(
+        total=int(os.environ.get("HTTP_RETRIES", RETRIES)),
+        backoff_factor=float(os.environ.get("HTTP_RETRY_BACKOFF", RETRY_BACKOFF)),
+        backoff_max=float(os.environ.get("HTTP_RETRY_BACKOFF_MAX", RETRY_BACKOFF_MAX)),
+        backoff_jitter=float(os.environ.get("HTTP_RETRY_JITTER", RETRY_JITTER)),
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+
+
+def get_session(username: str = None, password: str = None, retries: bool = True) -> requests.Session:
+    """
+    Get the shared session for the given credentials
+
+    :param username: Basic auth username, the session is unauthenticated if this or password is None
+    :param password: Basic auth password
+    :param retries: Retry failed requests, turn off for calls that retry on their own like _bulk
+    """
+
+    key = (username, password, retries)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = create_session(username, password, retries)
+
+        return _sessions[key]
+
+
+def create_session(username: str = None, password: str = None, retries: bool = True) -> requests.Session:
+    """Create a session with pooled, retrying and timed out connections"""
+
+    session = requests.Session()
+    session.headers.update({
+        "Content-Type": "application/json"
+    })
+
+    if username is not None and password is not None:
+        auth = base64.b64encode((username + ":" + password).encode('utf-8')).decode('utf-8')
+        session.headers.update({
+            "Authorization": f"Basic {auth}"
+        })
+
+    pool_maxsize = int(os.environ.get("HTTP_POOL_MAXSIZE", POOL_MAXSIZE))
+    retry = get_retry() if retries else Retry(total=0, raise_on_status=False)
+
+    adapter = TimeoutHTTPAdapter(pool_connections=int(os.environ.get("HTTP_POOL_CONNECTIONS", POOL_CONNECTIONS)), pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    logger.debug(f"Created HTTP session with {pool_maxsize} connections per host and {retry.total} retries")
+
+    return session
+
+
+def close_sessions():
+    """Close every shared session and its pooled connections"""
+
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
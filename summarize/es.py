@@ -1,64 +1,392 @@
+import gzip
 import json
-import requests
 import os
-import base64
 import logging
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable
 
 from datetime import date
 
+from summarize.client import get_session
+from summarize.metrics import span
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Hits in each page of a search_after
+SEARCH_AFTER_PAGE_SIZE = 5000
+
+# Bounds of a single bulk request
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+# Number of bulk requests in flight at once
+BULK_MAX_WORKERS = 4
+
+# Retries of the items rejected with a 429, the wait before retry n is backoff * 2^(n-1) plus up to backoff seconds
+BULK_MAX_RETRIES = 5
+BULK_RETRY_BACKOFF = 1
+BULK_RETRY_BACKOFF_MAX = 30
 
-def init_session(username: str = None, password: str = None):
-    """Initialize the session with basic authentication"""
 
-    session = requests.Session()
-    session.headers.update({
-        "Content-Type": "application/json"
-    })
+def init_session(username: str = None, password: str = None):
+    """Get the shared pooled session with basic authentication"""
 
-    if username is not None and password is not None:
-        auth = base64.b64encode((username + ":" + password).encode('utf-8')).decode('utf-8')
-        session.headers.update({
-            "Authorization": f"Basic {auth}"
-        })
+    return get_session(username, password)
 
-    return session
 
+def create_index(host: str, index_name: str, username: str = None, password: str = None, body: dict = None):
+    """
+    Create an index in Elasticsearch
 
-def create_index(host: str, index_name: str, username: str = None, password: str = None):
-    """Create an index in Elasticsearch"""
+    :param body: The settings and mappings of the index
+    """
 
     session = init_session(username, password)
-    session.put(f"{host}/{index_name}")
+    response = session.put(f"{host}/{index_name}", json=body)
+
+    if response.status_code != 200:
+        logger.error(f"Failed to create index {index_name}: {response.text}")
+        raise Exception(f"Failed to create index {index_name}: {response.text}")
+
     logger.info(f"Created index {index_name}")
 
 
-def index_documents(documents, host: str, index_name: str, username: str = None, password: str = None):
-    """Index documents into Elasticsearch"""
+def get_index(host: str, index_name: str, username: str = None, password: str = None):
+    """Get the aliases, mappings and settings of the indices an index name or alias resolves to, {} if none"""
+
+    session = init_session(username, password)
+    response = session.get(f"{host}/{index_name}")
+
+    if response.status_code == 404:
+        return {}
+
+    if response.status_code != 200:
+        logger.error(f"Failed to get index {index_name}: {response.text}")
+        raise Exception(f"Failed to get index {index_name}: {response.text}")
+
+    return response.json()
+
+
+def update_index_settings(host: str, index_name: str, settings: dict, username: str = None, password: str = None):
+    """Update the dynamic settings of an index, ex. {"refresh_interval": "-1"}"""
+
+    session = init_session(username, password)
+    response = session.put(f"{host}/{index_name}/_settings", json={"index": settings})
+
+    if response.status_code != 200:
+        logger.error(f"Failed to update the settings of {index_name}: {response.text}")
+        raise Exception(f"Failed to update the settings of {index_name}: {response.text}")
+
+
+def wait_for_index_health(host: str, index_name: str, status: str = "green", timeout: str = "5m", username: str = None, password: str = None):
+    """Wait for an index to reach a cluster health status, ex. green once its replicas are allocated"""
+
+    session = init_session(username, password)
+    response = session.get(f"{host}/_cluster/health/{index_name}", params={"wait_for_status": status, "timeout": timeout})
+
+    # A health check that times out answers 408 with timed_out set
+    if response.status_code != 200 or response.json().get("timed_out", False):
+        logger.error(f"{index_name} did not reach {status} health within {timeout}: {response.text}")
+        raise Exception(f"{index_name} did not reach {status} health within {timeout}: {response.text}")
+
+
+def refresh_index(host: str, index_name: str, username: str = None, password: str = None):
+    """Make everything indexed into an index searchable"""
+
+    session = init_session(username, password)
+    response = session.post(f"{host}/{index_name}/_refresh")
+
+    if response.status_code != 200:
+        logger.error(f"Failed to refresh {index_name}: {response.text}")
+        raise Exception(f"Failed to refresh {index_name}: {response.text}")
+
+
+def update_aliases(host: str, actions: list, username: str = None, password: str = None):
+    """Apply alias actions, ex. an add and a remove, atomically"""
+
+    session = init_session(username, password)
+    response = session.post(f"{host}/_aliases", json={"actions": actions})
+
+    if response.status_code != 200:
+        logger.error(f"Failed to update aliases: {response.text}")
+        raise Exception(f"Failed to update aliases: {response.text}")
+
+
+def delete_index(host: str, index_name: str, username: str = None, password: str = None):
+    """Delete an index"""
+
+    session = init_session(username, password)
+    response = session.delete(f"{host}/{index_name}")
+
+    if response.status_code != 200:
+        logger.error(f"Failed to delete index {index_name}: {response.text}")
+        raise Exception(f"Failed to delete index {index_name}: {response.text}")
+
+    logger.info(f"Deleted index {index_name}")
+
+
+def reindex(query: dict, host: str, source_index: str, dest_index: str, username: str = None, password: str = None):
+    """
+    Copy the documents matching a query from one index to another, keeping their ids
+
+    The reindex runs as a sliced background task which is polled until it finishes.
+
+    :return: The number of documents copied
+    """
+
+    session = init_session(username, password)
+
+    body = {
+        "source": {"index": source_index, **query},
+        "dest": {"index": dest_index}
+    }
+    response = session.post(f"{host}/_reindex", json=body, params={"slices": "auto", "wait_for_completion": "false"})
+
+    if response.status_code != 200:
+        logger.error(f"Failed to reindex {source_index} into {dest_index}: {response.text}")
+        raise Exception(f"Failed to reindex {source_index} into {dest_index}: {response.text}")
+
+    status = wait_for_task(host, response.json()["task"], username, password)
+
+    return status["created"] + status["updated"]
+
+
+def delete_by_query_task(query: dict, host: str, index_name: str, username: str = None, password: str = None, requests_per_second: float = None, progress: Callable = None):
+    """
+    Delete the documents matching a query as one sliced background task, polled until it finishes
+
+    :param requests_per_second: Throttle the delete to this many documents a second, unthrottled if None
+    :param progress: Called with the status of the task each time it is polled
+    :return: The number of documents deleted
+    """
 
     session = init_session(username, password)
 
-    body = ""
+    params = {"slices": "auto", "wait_for_completion": "false"}
+    if requests_per_second is not None:
+        params["requests_per_second"] = requests_per_second
+
+    response = session.post(f"{host}/{index_name}/_delete_by_query", json=query, params=params)
+
+    if response.status_code != 200:
+        logger.error(f"Failed to delete documents based on query: {response.text}")
+        raise Exception(f"Failed to delete documents based on query: {response.text}")
+
+    status = wait_for_task(host, response.json()["task"], username, password, progress=progress)
+
+    return status["deleted"]
+
+
+def wait_for_task(host: str, task_id: str, username: str = None, password: str = None, poll_seconds: float = 5, progress: Callable = None):
+    """
+    Poll a background task until it completes
+
+    :param progress: Called with the status of the task each time it is polled
+    :return: The status of the finished task
+    """
+
+    session = init_session(username, password)
+
+    while True:
+        response = session.get(f"{host}/_tasks/{task_id}")
+
+        if response.status_code != 200:
+            logger.error(f"Failed to get task {task_id}: {response.text}")
+            raise Exception(f"Failed to get task {task_id}: {response.text}")
+
+        task = response.json()
+        if task["completed"]:
+            break
+
+        status = task["task"]["status"]
+        logger.info(f"Task {task_id} {status.get('created', 0) + status.get('updated', 0) + status.get('deleted', 0)}/{status.get('total', 0)}")
+        if progress is not None:
+            progress(status)
+
+        time.sleep(poll_seconds)
+
+    if "error" in task or task.get("response", {}).get("failures"):
+        logger.error(f"Task {task_id} failed: {task.get('error') or task['response']['failures']}")
+        raise Exception(f"Task {task_id} failed: {task.get('error') or task['response']['failures']}")
+
+    return task["response"]
+
+
+def index_documents(documents, host: str, index_name: str, username: str = None, password: str = None, compress: bool = False, get_id: Callable = None):
+    """
+    Index documents into Elasticsearch
+
+    :param get_id: Function giving the _id of a document, documents with an existing _id are overwritten
+    """
+
+    indexed = bulk_index(documents, host, index_name, username, password, compress=compress, get_id=get_id)
+
+    logger.debug(f"Indexed {indexed} documents into {index_name}")
+
+
+def bulk_index(documents: Iterable, host: str, index_name: str, username: str = None, password: str = None, chunk_size: int = BULK_CHUNK_SIZE, max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES, max_workers: int = BULK_MAX_WORKERS, compress: bool = False, max_retries: int = BULK_MAX_RETRIES, get_id: Callable = None):
+    """
+    Index documents into Elasticsearch in bounded chunks sent from a pool of workers
+
+    The documents are serialized as they are consumed, so any iterable can be streamed in. Items the cluster rejects
+    with a 429 are retried with backoff, any other item failure is collected and raised once every chunk is sent.
+
+    :param chunk_size: The max number of documents in a bulk request
+    :param max_chunk_bytes: The max uncompressed size of a bulk request body
+    :param max_workers: The number of bulk requests in flight at once
+    :param compress: Gzip the bulk request bodies
+    :param max_retries: The number of times rejected items are resent before they are counted as failures
+    :param get_id: Function giving the _id of a document, if None Elasticsearch generates the ids
+    :return: The number of documents indexed
+    """
+
+    # send_bulk_chunk resends the rejected items itself, the session retrying the whole request too would compound them
+    session = get_session(username, password, retries=False)
+    url = f"{host}/{index_name}/_bulk"
+
+    indexed = 0
+    errors = []
+    with span("index_documents", index=index_name) as index_span, ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def collect(futures):
+            nonlocal indexed
+            for future in futures:
+                result = future.result()
+                indexed += result["indexed"]
+                errors.extend(result["errors"])
+                index_span.add(**result["counters"])
+
+        # Keep a bounded number of chunks in flight so the documents are never all serialized at once
+        pending = set()
+        for chunk in iter_bulk_chunks(documents, index_name, chunk_size, max_chunk_bytes, get_id):
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            pending.add(executor.submit(send_bulk_chunk, session, url, chunk, compress, max_retries))
+
+        collect(wait(pending).done)
+
+    if errors:
+        logger.error(f"Failed to index {len(errors)} documents: {errors[:10]}")
+        raise Exception(f"Failed to index {len(errors)} documents: {errors[:10]}")
+
+    return indexed
+
+
+def iter_bulk_chunks(documents: Iterable, index_name: str, chunk_size: int = BULK_CHUNK_SIZE, max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES, get_id: Callable = None):
+    """Serialize documents into lists of bulk items, each a bytes action and source pair, bounded in count and size"""
+
+    action = json.dumps({"index": {"_index": index_name}}).encode() + b"\n"
+
+    chunk = []
+    chunk_bytes = 0
     for doc in documents:
-        body += f'{{"index": {{"_index": "{index_name}"}}}}\n{json.dumps(doc)}\n'
+        if get_id is not None:
+            action = json.dumps({"index": {"_index": index_name, "_id": get_id(doc)}}).encode() + b"\n"
 
-    response = session.post(f"{host}/{index_name}/_doc/_bulk", data=body, headers={"Content-Type": "application/x-ndjson"})
+        item = (action, json.dumps(doc).encode() + b"\n")
+        item_bytes = len(item[0]) + len(item[1])
 
-    if response.status_code != 200 or response.json()['errors']:
-        logger.error(f"Failed to index documents: {response.text}")
-        raise Exception(f"Failed to index documents: {response.text}")
+        if chunk and (len(chunk) >= chunk_size or chunk_bytes + item_bytes > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
 
-    logger.debug(f"Indexed {len(documents)} documents into {index_name}")
+        chunk.append(item)
+        chunk_bytes += item_bytes
 
+    if chunk:
+        yield chunk
 
-def search(query, host, index_name, username: str = None, password: str = None):
-    """Query an index in Elasticsearch"""
+
+def send_bulk_chunk(session, url: str, items: list, compress: bool = False, max_retries: int = BULK_MAX_RETRIES):
+    """
+    Send one chunk of bulk items, resending the items rejected with a 429 until they succeed or run out of retries
+
+    :return: The number of items indexed, the errors of the items that failed and the counters for the span
+    """
+
+    indexed = 0
+    errors = []
+    rejected_errors = []
+    counters = defaultdict(float)
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(min(BULK_RETRY_BACKOFF * 2 ** (attempt - 1), BULK_RETRY_BACKOFF_MAX) + random.uniform(0, BULK_RETRY_BACKOFF))
+            counters["retried_records"] += len(items)
+
+        body = b"".join(part for item in items for part in item)
+        headers = {"Content-Type": "application/x-ndjson"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+            body = gzip.compress(body)
+
+        response = session.post(url, data=body, headers=headers, params={"filter_path": "errors,items.*.status,items.*.error"})
+        counters["bytes_sent"] += len(body)
+        counters["bytes_received"] += len(response.content)
+
+        # The whole request was rejected, resend all of it
+        if response.status_code == 429:
+            rejected_errors = [response.text] * len(items)
+            continue
+
+        if response.status_code != 200:
+            logger.error(f"Failed to index documents: {response.text}")
+            raise Exception(f"Failed to index documents: {response.text}")
+
+        response_json = response.json()
+        if not response_json["errors"]:
+            indexed += len(items)
+            items = []
+            break
+
+        rejected = []
+        rejected_errors = []
+        for item, result in zip(items, response_json["items"]):
+            result = next(iter(result.values()))
+            if result["status"] < 300:
+                indexed += 1
+            elif result["status"] == 429:
+                rejected.append(item)
+                rejected_errors.append(result.get("error"))
+            else:
+                errors.append(result.get("error"))
+
+        items = rejected
+        if not items:
+            break
+
+    # Whatever is still rejected after the last retry has failed
+    if items:
+        errors.extend(rejected_errors)
+    counters["records"] = indexed
+
+    return {"indexed": indexed, "errors": errors, "counters": counters}
+
+
+def search(query, host, index_name, username: str = None, password: str = None, filter_path: list = None):
+    """
+    Query an index in Elasticsearch
+
+    :param filter_path: The response paths to return, ex. ["hits.total.value", "aggregations.*.value"], the errors
+                        are always returned
+    """
 
     session = init_session(username, password)
+    body = json.dumps(query)
+    params = get_filter_path_params(filter_path)
+
+    with span("search", index=index_name) as search_span:
+        response = session.get(f"{host}/{index_name}/_search", data=body, params=params)
+        search_span.add(bytes_sent=len(body), bytes_received=len(response.content))
 
-    response = session.get(f"{host}/{index_name}/_search", json=query)
+    logger.debug(f"Searched {index_name}, sent {len(body)} and received {len(response.content)} bytes")
 
     if response.status_code != 200:
         logger.error(f"Failed to query index: {response.text}")
@@ -67,7 +395,120 @@ def search(query, host, index_name, username: str = None, password: str = None):
     return response.json()
 
 
+def get_filter_path_params(filter_path: list = None):
+    """Get the request params returning only the given response paths, keeping the error so failures can be read"""
+
+    if filter_path is None:
+        return None
+
+    return {"filter_path": ",".join([*filter_path, "error"])}
+
+
+def search_after(query: dict, host: str, index_name: str, username: str = None, password: str = None, page_size: int = SEARCH_AFTER_PAGE_SIZE, keep_alive: str = "1m"):
+    """
+    Page through every hit of a query with a point in time and search_after, yielding the hits a page at a time
+
+    The point in time keeps the pages consistent while documents are indexed and is closed once the generator is
+    exhausted or closed.
+
+    :param query: The query, may also set _source to limit the fields returned
+    :param page_size: The number of hits in each page
+    :param keep_alive: How long the point in time is kept between pages
+    """
+
+    session = init_session(username, password)
+
+    response = session.post(f"{host}/{index_name}/_pit", params={"keep_alive": keep_alive})
+    if response.status_code != 200:
+        logger.error(f"Failed to open a point in time on {index_name}: {response.text}")
+        raise Exception(f"Failed to open a point in time on {index_name}: {response.text}")
+
+    pit_id = response.json()["id"]
+    try:
+        last_sort = None
+        while True:
+            body = {
+                **query,
+                "size": page_size,
+                "track_total_hits": False,
+                "pit": {"id": pit_id, "keep_alive": keep_alive},
+                "sort": [{"_shard_doc": "asc"}]
+            }
+            if last_sort is not None:
+                body["search_after"] = last_sort
+
+            with span("search", index=index_name) as search_span:
+                response = session.post(f"{host}/_search", json=body, params=get_filter_path_params(["pit_id", "hits.hits._id", "hits.hits._source", "hits.hits.sort"]))
+                search_span.add(bytes_received=len(response.content))
+
+            logger.debug(f"Searched {index_name} after {last_sort}, received {len(response.content)} bytes")
+
+            if response.status_code != 200:
+                logger.error(f"Failed to query index: {response.text}")
+                raise Exception(f"Failed to query index: {response.text}")
+
+            response_json = response.json()
+            hits = response_json.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+
+            yield hits
+
+            if len(hits) < page_size:
+                break
+
+            pit_id = response_json.get("pit_id", pit_id)
+            last_sort = hits[-1]["sort"]
+    finally:
+        session.delete(f"{host}/_pit", json={"id": pit_id})
+
+
+def count(query: dict, host: str, index_name: str, username: str = None, password: str = None):
+    """Count the documents in an index matching a query"""
+
+    session = init_session(username, password)
+
+    with span("count", index=index_name) as count_span:
+        response = session.post(f"{host}/{index_name}/_count", json=query, params=get_filter_path_params(["count"]))
+        count_span.add(bytes_received=len(response.content))
+
+    if response.status_code != 200:
+        logger.error(f"Failed to count documents: {response.text}")
+        raise Exception(f"Failed to count documents: {response.text}")
+
+    return response.json()["count"]
+
+
+def msearch(queries: list, host: str, index_name: str, username: str = None, password: str = None, filter_path: list = None):
+    """
+    Run many queries against an index in one request, returns a response per query in order
+
+    :param filter_path: The paths to return of each response
+    """
+
+    session = init_session(username, password)
+
+    body = "".join(f"{{}}\n{json.dumps(query)}\n" for query in queries)
+
+    with span("msearch", index=index_name) as search_span:
+        response = session.post(f"{host}/{index_name}/_msearch", data=body, headers={"Content-Type": "application/x-ndjson"}, params=get_filter_path_params(filter_path and [f"responses.{path}" for path in [*filter_path, "error"]]))
+        search_span.add(bytes_sent=len(body), bytes_received=len(response.content))
+
+    if response.status_code != 200:
+        logger.error(f"Failed to query index: {response.text}")
+        raise Exception(f"Failed to query index: {response.text}")
+
+    responses = response.json()["responses"]
+    for r in responses:
+        if "error" in r:
+            logger.error(f"Failed to query index: {r['error']}")
+            raise Exception(f"Failed to query index: {r['error']}")
+
+    return responses
+
+
 def delete_by_query(query: dict, host: str, index_name: str, username: str = None, password: str = None):
+    """Delete the documents matching a query, returns the delete by query response"""
 
     session = init_session(username, password)
 
@@ -77,3 +518,4 @@ def delete_by_query(query: dict, host: str, index_name: str, username: str = Non
         logger.error(f"Failed to delete documents based on query: {response.text}")
         raise Exception(f"Failed to delete documents based on query: {response.text}")
 
+    return response.json()
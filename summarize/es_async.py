@@ -0,0 +1,92 @@
+"""
+Async counterparts of the summarize.es calls
+
+Each call runs the synchronous call in a worker thread over the shared pooled session, so it gets the same retries,
+timeouts and metrics, while a per event loop semaphore caps how many requests are in flight. Multi-day commands can
+then gather the calls for every day instead of waiting on them one day at a time.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from summarize import es
+
+# Max number of requests in flight at once from one event loop, keep it at or under the HTTP pool size. Overridden by
+# ES_CONCURRENCY, read on first use so the variables loaded from an --env-file apply
+ES_CONCURRENCY = 8
+
+_semaphores = weakref.WeakKeyDictionary()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_concurrency() -> int:
+    """Get the max number of requests in flight at once from one event loop"""
+
+    return int(os.environ.get("ES_CONCURRENCY", ES_CONCURRENCY))
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore limiting the requests of the running event loop"""
+
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(get_concurrency())
+
+    return _semaphores[loop]
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the worker threads the calls run in, the default executor has as few as 5 threads"""
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_concurrency(), thread_name_prefix="es_async")
+
+        return _executor
+
+
+async def run(func: Callable, *args, **kwargs):
+    """Run a blocking call in a worker thread once the concurrency limit allows"""
+
+    async with get_semaphore():
+        # Run in a copy of the current context so metric spans keep their labels, as asyncio.to_thread does
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+async def search(query: dict, host: str, index_name: str, username: str = None, password: str = None, filter_path: list = None):
+    """Query an index in Elasticsearch"""
+
+    return await run(es.search, query, host, index_name, username, password, filter_path)
+
+
+async def count(query: dict, host: str, index_name: str, username: str = None, password: str = None):
+    """Count the documents in an index matching a query"""
+
+    return await run(es.count, query, host, index_name, username, password)
+
+
+async def msearch(queries: list, host: str, index_name: str, username: str = None, password: str = None, filter_path: list = None):
+    """Run many queries against an index in one request"""
+
+    return await run(es.msearch, queries, host, index_name, username, password, filter_path)
+
+
+async def bulk_index(documents: Iterable, host: str, index_name: str, username: str = None, password: str = None, **kwargs):
+    """Index documents into Elasticsearch, see summarize.es.bulk_index"""
+
+    return await run(es.bulk_index, documents, host, index_name, username, password, **kwargs)
+
+
+async def delete_by_query(query: dict, host: str, index_name: str, username: str = None, password: str = None):
+    """Delete the documents matching a query"""
+
+    return await run(es.delete_by_query, query, host, index_name, username, password)
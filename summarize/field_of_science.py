@@ -2,6 +2,9 @@
 Used to map SED-CIP codes to their string representations
 """
 
+import hashlib
+import logging
+import pickle
 import warnings
 import os
 from typing import Union
@@ -9,30 +12,36 @@ import string
 
 import pandas as pd
 
+# Configure logging
+logger = logging.getLogger(__name__)
+
 # Turn this path relative to this file into an absolute path with python
 # File can be downloaded here: https://ncses.nsf.gov/pubs/nsf24300/assets/technical-notes/tables/nsf24300-taba-005.xlsx
 SED_CIP_FILE_RELATIVE = "../data/SED-CIP-2022.xlsx"
 SED_CIP_FILE = os.path.join(os.path.dirname(__file__), SED_CIP_FILE_RELATIVE)
 
+# The CIP table parsed out of SED_CIP_FILE, rebuilt whenever the spreadsheet changes
+SED_CIP_CACHE_FILE = os.path.join(os.path.dirname(__file__), "../data/SED-CIP-2022.compiled.pkl")
+
 
 class FieldOfScienceMapper:
     """
     Maps a SED-CIP code to their string representations
+
+    Every lookup is answered from dicts compiled from the CIP sheet at construction, one of the exact SED-CIP codes
+    and one of every broad, major and detailed id prefix to its most common fields.
     """
 
     def __init__(self):
         self.cip_df = self.get_cip_df()
+        self.direct_matches = self._get_direct_matches(self.cip_df)
+        self.prefix_matches = self._get_prefix_matches(self.cip_df)
 
     def map_id_to_fields_of_science(self, id: str):
 
         # If we have a direct match, return it
-        direct_match = self.cip_df[self.cip_df["SED-CIP code"] == id]
-        if len(direct_match) > 0:
-            return [
-                direct_match["New broad field"].values[0],
-                direct_match["New major field"].values[0],
-                direct_match["New detailed field"].values[0]
-            ]
+        if not pd.isna(id) and id in self.direct_matches:
+            return list(self.direct_matches[id])
 
         # Otherwise we look for the most likely match
         return self._get_most_common_match(id)
@@ -57,96 +66,81 @@ class FieldOfScienceMapper:
         major_id = self._get_id(id, 1)
         detailed_id = self._get_id(id, 2)
 
-        # Pull out the rows that match the given ids, if none match then return empty result
-        try:
-            matching_rows = self._get_matching_rows(broad_id, major_id, detailed_id)
-        except ValueError as e:
-            return [None, None, None]
-
-        # Define the fields we hope to populate
-        broad_field_of_science = None
-        major_field_of_science = None
-        detailed_field_of_science = None
-
-        # Pull out the Broad Field that occurs the most often in the matching rows
-        possible_broad_fields = set(map(lambda x: x[1]['New broad field'], matching_rows.iterrows()))
-        if broad_id is not None:
-            best_option = None
-            max_rows = 0
-            for possible_broad_field in possible_broad_fields:
-                l = len(
-                    self.cip_df[
-                        (self.cip_df["BroadFieldId"] == broad_id) &
-                        (self.cip_df["New broad field"] == possible_broad_field)
-                    ]
-                )
-
-                if l > max_rows:
-                    max_rows = l
-                    best_option = possible_broad_field
-
-            broad_field_of_science = best_option
-
-        # Pull out the Major Field that occurs the most often in the matching rows
-        possible_major_fields = set(map(lambda x: x[1]['New major field'], matching_rows.iterrows()))
-        if major_id is not None:
-            best_option = None
-            max_rows = 0
-            for possible_major_field in possible_major_fields:
-                l = len(self.cip_df[(self.cip_df["BroadFieldId"] == broad_id) & (self.cip_df['MajorFieldId'] == major_id) & (
-                            self.cip_df["New major field"] == possible_major_field)])
-                if l > max_rows:
-                    max_rows = l
-                    best_option = possible_major_field
-
-            major_field_of_science = best_option
-
-        # Pull out the Detailed Field that occurs the most often in the matching rows
-        possible_detailed_fields = set(map(lambda x: x[1]['New detailed field'], matching_rows.iterrows()))
-        if detailed_id is not None:
-            best_option = None
-            max_rows = 0
-            for possible_detailed_field in possible_detailed_fields:
-                l = len(
-                    self.cip_df[
-                        (self.cip_df["BroadFieldId"] == broad_id) &
-                        (self.cip_df['MajorFieldId'] == major_id) &
-                        (self.cip_df["DetailedFieldId"] == detailed_id) &
-                        (self.cip_df["New detailed field"] == possible_detailed_field)
-                    ]
-                )
-                if l > max_rows:
-                    max_rows = l
-                    best_option = possible_detailed_field
-
-            detailed_field_of_science = best_option
-
-        return [broad_field_of_science, major_field_of_science, detailed_field_of_science]
-
-    def _get_matching_rows(self, broad_id, major_id, detailed_id):
-        """Get the rows that match the given broad, major, and detailed ids"""
-
-        # Check the finest grain first
-        detailed_rows = self.cip_df[
-            (self.cip_df["BroadFieldId"] == broad_id) & (self.cip_df['MajorFieldId'] == major_id) & (
-                    self.cip_df["DetailedFieldId"] == detailed_id)]
-
-        if len(detailed_rows) > 0:
-            return detailed_rows
-
-        # Check the major grain
-        major_rows = self.cip_df[(self.cip_df["BroadFieldId"] == broad_id) & (self.cip_df['MajorFieldId'] == major_id)]
-
-        if len(major_rows) > 0:
-            return major_rows
-
-        # Check the broad grain
-        broad_rows = self.cip_df[self.cip_df["BroadFieldId"] == broad_id]
-
-        if len(broad_rows) > 0:
-            return broad_rows
-
-        raise ValueError(f"No matching rows for {broad_id}.{major_id}{detailed_id}")
+        # Match on the finest grain there are rows for, if none match then return empty result
+        for key in ((broad_id, major_id, detailed_id), (broad_id, major_id, None), (broad_id, None, None)):
+            if key in self.prefix_matches:
+                return list(self.prefix_matches[key])
+
+        return [None, None, None]
+
+    @staticmethod
+    def _get_direct_matches(cip_df: pd.DataFrame):
+        """Get the map of each SED-CIP code to the fields of its first row"""
+
+        direct_matches = {}
+        for code, broad_field, major_field, detailed_field in zip(cip_df["SED-CIP code"], cip_df["New broad field"], cip_df["New major field"], cip_df["New detailed field"]):
+            if not pd.isna(code):
+                direct_matches.setdefault(code, (broad_field, major_field, detailed_field))
+
+        return direct_matches
+
+    @staticmethod
+    def _get_prefix_matches(cip_df: pd.DataFrame):
+        """
+        Get the map of every (broad, major, detailed) id prefix in the sheet to its most common fields
+
+        A (broad, major, detailed) key holds the result for ids matching rows at the detailed grain, a
+        (broad, major, None) key for ids matching at the major grain and a (broad, None, None) key for ids matching
+        only at the broad grain. Ids whose finer parts aren't in the sheet get the result of their coarser key.
+        """
+
+        # Group the rows by each grain of their id, in sheet order
+        rows = {}
+        for row in zip(cip_df["BroadFieldId"], cip_df["MajorFieldId"], cip_df["DetailedFieldId"], cip_df["New broad field"], cip_df["New major field"], cip_df["New detailed field"]):
+            broad_id, major_id, detailed_id = (None if pd.isna(x) else x for x in row[:3])
+            if broad_id is None:
+                continue
+
+            rows.setdefault((broad_id, None, None), []).append(row[3:])
+            if major_id is not None:
+                rows.setdefault((broad_id, major_id, None), []).append(row[3:])
+                if detailed_id is not None:
+                    rows.setdefault((broad_id, major_id, detailed_id), []).append(row[3:])
+
+        # Count the rows of each field at the grain it is voted on, broad fields over the broad id and so on
+        counts = {}
+        for (broad_id, major_id, detailed_id), key_rows in rows.items():
+            grain = 2 if detailed_id is not None else 1 if major_id is not None else 0
+            for fields in key_rows:
+                if not pd.isna(fields[grain]):
+                    count_key = (broad_id, major_id, detailed_id, fields[grain])
+                    counts[count_key] = counts.get(count_key, 0) + 1
+
+        prefix_matches = {}
+        for key, key_rows in rows.items():
+            broad_id, major_id, detailed_id = key
+            vote_keys = [(broad_id, None, None), (broad_id, major_id, None), (broad_id, major_id, detailed_id)]
+
+            fields_of_science = []
+            for grain, vote_key in enumerate(vote_keys):
+                if vote_key[grain] is None:
+                    fields_of_science.append(None)
+                    continue
+
+                # Ties go to the first of the candidates the set yields, as they did when voting on the DataFrame
+                best_option = None
+                max_rows = 0
+                for possible_field in set(fields[grain] for fields in key_rows):
+                    l = counts.get((*vote_key, possible_field), 0)
+                    if l > max_rows:
+                        max_rows = l
+                        best_option = possible_field
+
+                fields_of_science.append(best_option)
+
+            prefix_matches[key] = tuple(fields_of_science)
+
+        return prefix_matches
 
     @staticmethod
     def _get_id(id: Union[float, str], granularity: int):
@@ -191,7 +185,20 @@ class FieldOfScienceMapper:
 
     @staticmethod
     def get_cip_df():
-        """Get the CIP data as a DataFrame, adding some columns for easier querying"""
+        """Get the CIP data as a DataFrame, from the compiled cache unless the spreadsheet has changed since"""
+
+        key = get_cip_cache_key()
+
+        cip_df = load_cip_cache(key)
+        if cip_df is None:
+            cip_df = FieldOfScienceMapper.read_cip_df()
+            save_cip_cache(key, cip_df)
+
+        return cip_df
+
+    @staticmethod
+    def read_cip_df():
+        """Read the CIP data from the spreadsheet as a DataFrame, adding some columns for easier querying"""
 
         # Works fine, lets ignore the warning
         with warnings.catch_warnings():
@@ -206,4 +213,46 @@ class FieldOfScienceMapper:
         cip_df["MajorFieldId"] = cip_df['SED-CIP code'].apply(lambda x: FieldOfScienceMapper._get_id(x, 1))
         cip_df["DetailedFieldId"] = cip_df['SED-CIP code'].apply(lambda x: FieldOfScienceMapper._get_id(x, 2))
 
-        return cip_df
\ No newline at end of file
+        return cip_df
+
+
+def get_cip_cache_key():
+    """Key the compiled CIP table on the spreadsheet contents and the pandas version that pickled it"""
+
+    with open(SED_CIP_FILE, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    return f"{digest}|{pd.__version__}"
+
+
+def load_cip_cache(key: str):
+    """Load the compiled CIP table, returns None if there is none for this key"""
+
+    if not os.path.exists(SED_CIP_CACHE_FILE):
+        return None
+
+    try:
+        with open(SED_CIP_CACHE_FILE, "rb") as f:
+            cache = pickle.load(f)
+
+        if cache.get("key") == key:
+            return cache["cip_df"]
+
+    except Exception as e:
+        logger.warning(f"Could not read {SED_CIP_CACHE_FILE}, rebuilding it: {e}")
+
+    return None
+
+
+def save_cip_cache(key: str, cip_df: pd.DataFrame):
+    """Save the compiled CIP table for the next run, written to a temporary file and renamed so it is never partial"""
+
+    tmp_file = f"{SED_CIP_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            pickle.dump({"key": key, "cip_df": cip_df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_file, SED_CIP_CACHE_FILE)
+
+    except IOError as e:
+        logger.warning(f"Could not write {SED_CIP_CACHE_FILE}: {e}")
@@ -1,10 +1,21 @@
-import requests
 import functools
+import os
+
+from summarize.snapshots import get_snapshot_json
+
+# Base URL of the Institution API unless INSTITUTION_API_HOST is set, point that at a stand-in server to run offline
+INSTITUTION_API_HOST = "https://topology-institutions.osg-htc.org"
+
+
+def get_institution_api_host():
+    """Get the base URL of the Institution API, read on use so the variables loaded from an --env-file apply"""
+
+    return os.environ.get("INSTITUTION_API_HOST", INSTITUTION_API_HOST)
 
 
 @functools.lru_cache(maxsize=1)
 def get_institution_id_to_metadata_map():
-    institutions = {i['id']: i for i in requests.get("https://topology-institutions.osg-htc.org/api/institution_ids").json()}
+    institutions = {i['id']: i for i in get_snapshot_json(f"{get_institution_api_host()}/api/institution_ids")}
 
     # Add in the institutions modified id's that are found in the MachineAttr in format `osg-htc.org_iid_<hex>`
     for k, v in [*institutions.items()]:
@@ -2,22 +2,35 @@
 Generates mapped summary records for the OSPool
 """
 import datetime
+import hashlib
+import itertools
+import json
 import logging
 from collections import defaultdict
+from typing import Iterable
 
 import pandas as pd
 
 from summarize.field_of_science import FieldOfScienceMapper
-from summarize.adstash import get_ospool_ad_summary
+from summarize.metrics import span
+from summarize.adstash import get_ospool_ad_summary, get_ospool_ad_summary_by_day, iter_ospool_ad_summary
 from summarize.institution_api import get_institution_id_to_metadata_map
-from summarize.topology import get_resource_to_institution_id_map, get_acct_group_to_project_metadata_map, get_resource_group_to_institution_id_map
+from summarize.resource_institution import ResourceInstitutionResolver
+from summarize.topology import get_acct_group_to_project_metadata_map
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# The number of flat records mapped at a time
+ENRICH_CHUNK_SIZE = 10000
 
-def get_summary_records(start: datetime.datetime = None, end: datetime.datetime = None, host: str = None):
-    """Get the summary records for a single day, defaults to span UTC yesterday"""
+
+def get_summary_records(start: datetime.datetime = None, end: datetime.datetime = None, host: str = None, resource_name_script: bool = False, stream: bool = False):
+    """
+    Get the summary records for a single day, defaults to span UTC yesterday
+
+    :param stream: Map the adstash records as they are parsed out of the response instead of after it is loaded
+    """
 
     # If start is None, set the range to span yesterday
     if start is None:
@@ -28,83 +41,134 @@ def get_summary_records(start: datetime.datetime = None, end: datetime.datetime
     if end is None:
         end = start + datetime.timedelta(days=1)
 
-    # Set up the mappers
-    acct_group_to_metadata_map = get_acct_group_to_project_metadata_map()
-    institution_id_to_metadata_map = get_institution_id_to_metadata_map()
-    fos_mapper = FieldOfScienceMapper()
+    if stream:
+        ospool_ad_summary = iter_ospool_ad_summary(start=start, end=end, host=host, resource_name_script=resource_name_script)
+    else:
+        ospool_ad_summary = get_ospool_ad_summary(start=start, end=end, host=host, resource_name_script=resource_name_script)
 
-    ospool_ad_summary = get_ospool_ad_summary(start=start, end=end, host=host)
+    return map_summary_records(ospool_ad_summary, start.date())
 
-    summary_records = []
-    for summary_record in ospool_ad_summary:
-        resource = summary_record['ResourceName']
-        acct_group = summary_record['AcctGroup']
-
-        broad_field_of_science, major_field_of_science, detailed_field_of_science = fos_mapper.map_id_to_fields_of_science(
-            acct_group_to_metadata_map.get(acct_group.lower(), {}).get('FieldOfScienceID', None)
-        )
-        project_institution = institution_id_to_metadata_map.get(acct_group_to_metadata_map.get(acct_group.lower(), {}).get('InstitutionID', None), None)
-        resource_institution = get_resource_institution(summary_record)
-
-        summary_records.append({
-            "ProjectInstitution": project_institution,
-            "ResourceInstitution": resource_institution,
-            "ResourceInstitutionID": resource_institution['id'] if resource_institution is not None else None,
-            'ResourceName': resource,
-            'ProjectName': acct_group,
-            'BroadFieldOfScience': broad_field_of_science,
-            'MajorFieldOfScience': major_field_of_science,
-            'DetailedFieldOfScience': detailed_field_of_science,
-            'NumJobs': summary_record['NumJobs'],
-            'CpuHours': summary_record['CpuHours'],
-            'GpuHours': summary_record['GpuHours'],
-            'OSDFFileTransferCount': summary_record['OSDFFileTransferCount'],
-            'OSDFByteTransferCount': summary_record['OSDFByteTransferCount'],
-            'FileTransferCount': summary_record['FileTransferCount'],
-            'ByteTransferCount': summary_record['ByteTransferCount'],
-            'isNRP': summary_record['isNRP'],
-            'Date': str(start.date())
-        })
 
-    return summary_records
+def get_summary_records_by_day(day_ranges: dict, host: str = None, resource_name_script: bool = False):
+    """
+    Get the summary records for many days with a single adstash query
 
+    :param day_ranges: Map of day to the (start, end) datetimes the day spans
+    :return: Map of day to the summary records for that day
+    """
 
-def get_resource_institution(record: dict):
-    """Find the matching institution ID and subsequent metadata for the given record"""
+    # Hold the flat records of the days compactly until each day is mapped
+    ospool_ad_summaries = get_ospool_ad_summary_by_day(day_ranges, host=host, resource_name_script=resource_name_script, compact=True)
 
-    # If the record has an institution ID, use that
-    if 'InstitutionID' in record and record['InstitutionID'] != "UNKNOWN":
-        logger.debug(f"Resource {record['ResourceName']} has an InstitutionID")
+    # Every day resolves against the same topology
+    with span("mapper_setup"):
+        resource_institution_resolver = ResourceInstitutionResolver.from_topology()
 
-        institution = get_institution_id_to_metadata_map().get(record['InstitutionID'], None)
+    return {day: map_summary_records(ospool_ad_summaries[day], start.date(), resource_institution_resolver) for day, (start, _) in day_ranges.items()}
 
-        logger.debug(f"Resource {record['ResourceName']} has InstitutionID {record['InstitutionID']}")
 
-        return institution
+def map_summary_records(ospool_ad_summary: Iterable, date: datetime.date, resource_institution_resolver: ResourceInstitutionResolver = None):
+    """
+    Map the flat adstash records for a day onto their project, field of science and institution metadata
 
-    # If the record has a resource name, use that
-    if record['ResourceName'].lower() in get_resource_to_metadata_map():
-        return get_resource_to_metadata_map()[record['ResourceName'].lower()]
+    Each distinct project and each distinct institution and resource is resolved once, then joined back onto the
+    records, as the same project runs on many resources and the same resource runs many projects. The records are
+    mapped ENRICH_CHUNK_SIZE at a time as they are read, so a streamed summary is never held whole.
 
-    # It isn't odd for a 'ResourceName' to be a resource group, so check that too
-    if record['ResourceName'].lower() in get_resource_group_to_metadata_map():
-        return get_resource_group_to_metadata_map()[record['ResourceName'].lower()]
+    :param resource_institution_resolver: The resolver to find each resource's institution with, built from topology if None
+    """
 
-    return None
+    # Set up the mappers
+    with span("mapper_setup"):
+        acct_group_to_metadata_map = get_acct_group_to_project_metadata_map()
+        institution_id_to_metadata_map = get_institution_id_to_metadata_map()
+        fos_mapper = FieldOfScienceMapper()
 
+        if resource_institution_resolver is None:
+            resource_institution_resolver = ResourceInstitutionResolver.from_topology()
+
+    # The projects and resources resolved so far, shared by every chunk of the day
+    project_indexes = {}
+    project_metadata = []
+    resource_indexes = {}
+    resource_institutions = []
+
+    summary_records = []
+    ospool_ad_summary = iter(ospool_ad_summary)
+    while chunk := list(itertools.islice(ospool_ad_summary, ENRICH_CHUNK_SIZE)):
+        with span("enrich", date=date) as enrich_span:
+
+            # A record without an InstitutionID resolves the same as an UNKNOWN one
+            keys = pd.DataFrame({
+                "AcctGroup": pd.Series([r['AcctGroup'] for r in chunk], dtype=object),
+                "InstitutionID": pd.Series([r.get('InstitutionID', "UNKNOWN") for r in chunk], dtype=object),
+                "ResourceName": pd.Series([r['ResourceName'] for r in chunk], dtype=object),
+            })
+
+            # Resolve each distinct project once
+            projects = keys[["AcctGroup"]].drop_duplicates(ignore_index=True)
+            for acct_group in projects["AcctGroup"]:
+                if acct_group not in project_indexes:
+                    project = acct_group_to_metadata_map.get(acct_group.lower(), {})
+                    project_indexes[acct_group] = len(project_metadata)
+                    project_metadata.append((
+                        institution_id_to_metadata_map.get(project.get('InstitutionID', None), None),
+                        *fos_mapper.map_id_to_fields_of_science(project.get('FieldOfScienceID', None))
+                    ))
+            projects["ProjectIndex"] = [project_indexes[acct_group] for acct_group in projects["AcctGroup"]]
+
+            # Resolve each distinct institution and resource once
+            resources = keys[["InstitutionID", "ResourceName"]].drop_duplicates(ignore_index=True)
+            for resource_key in zip(resources["InstitutionID"], resources["ResourceName"]):
+                if resource_key not in resource_indexes:
+                    institution_id, resource_name = resource_key
+                    resource_indexes[resource_key] = len(resource_institutions)
+                    resource_institutions.append(resource_institution_resolver.resolve({"InstitutionID": institution_id, "ResourceName": resource_name}))
+            resources["ResourceIndex"] = [resource_indexes[resource_key] for resource_key in zip(resources["InstitutionID"], resources["ResourceName"])]
+
+            # Join the resolved projects and resources back onto the records, a left merge keeps the record order
+            joined = keys.merge(projects, on="AcctGroup", how="left").merge(resources, on=["InstitutionID", "ResourceName"], how="left")
+
+            for summary_record, project_index, resource_index in zip(chunk, joined["ProjectIndex"].tolist(), joined["ResourceIndex"].tolist()):
+                project_institution, broad_field_of_science, major_field_of_science, detailed_field_of_science = project_metadata[project_index]
+                resource_institution = resource_institutions[resource_index]
+
+                summary_records.append({
+                    "ProjectInstitution": project_institution,
+                    "ResourceInstitution": resource_institution,
+                    "ResourceInstitutionID": resource_institution['id'] if resource_institution is not None else None,
+                    'ResourceName': summary_record['ResourceName'],
+                    'ProjectName': summary_record['AcctGroup'],
+                    'BroadFieldOfScience': broad_field_of_science,
+                    'MajorFieldOfScience': major_field_of_science,
+                    'DetailedFieldOfScience': detailed_field_of_science,
+                    'NumJobs': summary_record['NumJobs'],
+                    'CpuHours': summary_record['CpuHours'],
+                    'GpuHours': summary_record['GpuHours'],
+                    'OSDFFileTransferCount': summary_record['OSDFFileTransferCount'],
+                    'OSDFByteTransferCount': summary_record['OSDFByteTransferCount'],
+                    'FileTransferCount': summary_record['FileTransferCount'],
+                    'ByteTransferCount': summary_record['ByteTransferCount'],
+                    'isNRP': summary_record['isNRP'],
+                    'Date': str(date)
+                })
+
+            enrich_span.add(records=len(chunk), projects=len(projects), resources=len(resources))
+
+    return summary_records
 
-def get_resource_to_metadata_map():
-    resource_to_institution_id_map = get_resource_to_institution_id_map()
-    institution_id_to_metadata_map = get_institution_id_to_metadata_map()
 
-    return {resource.lower(): institution_id_to_metadata_map.get(institution_id, None) for resource, institution_id in resource_to_institution_id_map.items()}
+def get_summary_record_id(record: dict):
+    """
+    Get the deterministic document id of a summary record
 
+    A day has one record per raw institution, resource and project, so regenerating a day overwrites its documents
+    in place instead of duplicating them.
+    """
 
-def get_resource_group_to_metadata_map():
-    resource_group_to_institution_id_map = get_resource_group_to_institution_id_map()
-    institution_id_to_metadata_map = get_institution_id_to_metadata_map()
+    key = json.dumps([record['Date'], record['ProjectName'], record['ResourceName'], record['isNRP']])
 
-    return {resource_group.lower(): institution_id_to_metadata_map.get(institution_id, None) for resource_group, institution_id in resource_group_to_institution_id_map.items()}
+    return hashlib.sha256(key.encode()).hexdigest()
 
 
 def main():
@@ -0,0 +1,123 @@
+"""
+Stage timing for the summarize pipeline
+
+Stages are wrapped in spans that record their wall time and any counters the stage reports (ES took, bytes sent
+and received, records). Spans inherit the labels of the span they are nested in, so wrapping a day in
+`span("day", date=...)` labels every stage run for that day. The collected spans can be exported as JSON or in the
+Prometheus textfile collector format.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = "ospool_summary"
+
+_spans = []
+_spans_lock = threading.Lock()
+_labels = contextvars.ContextVar("labels", default={})
+
+
+class Span:
+    """A single timed run of a stage"""
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        self.counters = defaultdict(float)
+        self.wall_seconds = None
+
+    def add(self, **counters):
+        """Add to the counters of this span, ex. span.add(bytes_received=len(response.content))"""
+
+        for key, value in counters.items():
+            self.counters[key] += value
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "labels": self.labels,
+            "wall_seconds": self.wall_seconds,
+            **self.counters
+        }
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time the enclosed block as a run of the given stage"""
+
+    labels = {**_labels.get(), **{k: str(v) for k, v in labels.items()}}
+    token = _labels.set(labels)
+
+    s = Span(stage, labels)
+    start = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.wall_seconds = time.perf_counter() - start
+        _labels.reset(token)
+
+        with _spans_lock:
+            _spans.append(s)
+
+        logger.debug(f"{stage} {labels} took {s.wall_seconds:.3f}s {dict(s.counters)}")
+
+
+def get_spans():
+    """Get the spans recorded so far"""
+
+    with _spans_lock:
+        return list(_spans)
+
+
+def reset():
+    """Drop the spans recorded so far"""
+
+    with _spans_lock:
+        _spans.clear()
+
+
+def export_json(path: str):
+    """Write every recorded span to a JSON file"""
+
+    Path(path).write_text(json.dumps([s.to_dict() for s in get_spans()], indent=2))
+
+
+def export_prometheus(path: str):
+    """
+    Write the recorded spans in the Prometheus textfile collector format
+
+    Spans of the same stage and labels are summed into one sample per metric. The file is written to a temporary
+    path and renamed so the collector never reads a partial file.
+    """
+
+    totals = defaultdict(lambda: defaultdict(float))
+    for s in get_spans():
+        key = (s.stage, tuple(sorted(s.labels.items())))
+        totals[key]["wall_seconds"] += s.wall_seconds
+        totals[key]["runs"] += 1
+        for counter, value in s.counters.items():
+            totals[key][counter] += value
+
+    samples = defaultdict(list)
+    for (stage, labels), values in totals.items():
+        label_string = ",".join(f'{k}="{v}"' for k, v in (("stage", stage), *labels))
+        for counter, value in values.items():
+            samples[f"{METRIC_PREFIX}_stage_{counter}_total"].append(f"{METRIC_PREFIX}_stage_{counter}_total{{{label_string}}} {value}")
+
+    lines = []
+    for metric, metric_samples in sorted(samples.items()):
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(metric_samples)
+
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_text("\n".join(lines) + "\n")
+    tmp_path.rename(path)
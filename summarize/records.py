@@ -0,0 +1,146 @@
+"""
+Compact flat adstash records
+
+A flat record holds a handful of fixed fields and one sum per transfer key, often hundreds of them. Storing every
+record as a dict repeats the transfer keys and boxes every sum, FlatRecordBatch instead stores the transfer sums
+of all the records in one contiguous float matrix with a single shared key index. FlatRecord keeps dict style
+access so the records can be used anywhere the dict records are.
+"""
+from typing import Iterator
+
+import numpy as np
+
+# The fixed fields of a flat record in the order the dict records list them
+FIXED_FIELDS = (
+    "isNRP",
+    "InstitutionID",
+    "ResourceName",
+    "AcctGroup",
+    "NumJobs",
+    "GpuHours",
+    "CpuHours",
+    "OSDFFileTransferCount",
+    "OSDFByteTransferCount",
+    "FileTransferCount",
+    "ByteTransferCount",
+)
+
+
+class FlatRecord:
+    """A single institution, resource and project record, its transfer sums are a row of the batch matrix"""
+
+    __slots__ = (
+        "InstitutionID",
+        "ResourceName",
+        "AcctGroup",
+        "NumJobs",
+        "GpuHours",
+        "CpuHours",
+        "OSDFFileTransferCount",
+        "OSDFByteTransferCount",
+        "FileTransferCount",
+        "ByteTransferCount",
+        "transfer",
+        "key_index",
+    )
+
+    InstitutionID: str
+    ResourceName: str
+    AcctGroup: str
+    NumJobs: int
+    GpuHours: float
+    CpuHours: float
+    OSDFFileTransferCount: float
+    OSDFByteTransferCount: float
+    FileTransferCount: float
+    ByteTransferCount: float
+    transfer: np.ndarray
+    key_index: dict
+
+    @property
+    def isNRP(self):
+        return self.InstitutionID
+
+    def __getitem__(self, key: str):
+        if key in FIXED_FIELDS:
+            return getattr(self, key)
+
+        return float(self.transfer[self.key_index[key]])
+
+    def __contains__(self, key: str):
+        return key in FIXED_FIELDS or key in self.key_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(FIXED_FIELDS) + len(self.key_index)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [*FIXED_FIELDS, *self.key_index.keys()]
+
+    def values(self):
+        return [getattr(self, field) for field in FIXED_FIELDS] + self.transfer.tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (FlatRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+
+        return NotImplemented
+
+    def __repr__(self):
+        return f"FlatRecord({self.InstitutionID!r}, {self.ResourceName!r}, {self.AcctGroup!r}, NumJobs={self.NumJobs})"
+
+
+class FlatRecordBatch:
+    """A sequence of FlatRecords sharing one transfer key index and one contiguous transfer sum matrix"""
+
+    def __init__(self, keys: list, num_jobs: np.ndarray, gpu_hours: np.ndarray, cpu_hours: np.ndarray, totals: np.ndarray, transfer: np.ndarray, transfer_keys: list):
+        """
+        :param keys: The (institution, resource, project) of each record
+        :param totals: The OSDF file, OSDF byte, file and byte transfer totals of each record
+        :param transfer: The transfer sums of each record, one column per transfer key
+        """
+
+        self.key_index = {key: i for i, key in enumerate(transfer_keys)}
+        self.transfer = np.ascontiguousarray(transfer, dtype=float).reshape(len(keys), len(transfer_keys))
+
+        num_jobs = num_jobs.tolist()
+        gpu_hours = gpu_hours.tolist()
+        cpu_hours = cpu_hours.tolist()
+        totals = totals.tolist()
+
+        self.records = []
+        for i, (institution_id, resource_name, acct_group) in enumerate(keys):
+            record = FlatRecord()
+            record.InstitutionID = institution_id
+            record.ResourceName = resource_name
+            record.AcctGroup = acct_group
+            record.NumJobs = int(num_jobs[i])
+            record.GpuHours = gpu_hours[i]
+            record.CpuHours = cpu_hours[i]
+            record.OSDFFileTransferCount, record.OSDFByteTransferCount, record.FileTransferCount, record.ByteTransferCount = totals[i]
+            record.transfer = self.transfer[i]
+            record.key_index = self.key_index
+            self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def __iter__(self) -> Iterator[FlatRecord]:
+        return iter(self.records)
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self.records]
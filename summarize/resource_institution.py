@@ -0,0 +1,56 @@
+"""
+Used to map the resources jobs ran on to their institutions
+"""
+import logging
+
+from summarize.institution_api import get_institution_id_to_metadata_map
+from summarize.topology import get_resource_to_institution_id_map, get_resource_group_to_institution_id_map
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ResourceInstitutionResolver:
+    """
+    Maps a summary record to the institution of the resource it ran on
+
+    The institution id, resource name and resource group indexes are built once, so resolving a record is a few dict
+    lookups however many resources Topology has.
+    """
+
+    def __init__(self, resource_to_institution_id_map: dict, resource_group_to_institution_id_map: dict, institution_id_to_metadata_map: dict):
+        self.institution_id_to_metadata_map = institution_id_to_metadata_map
+
+        self.resource_to_metadata_map = {
+            resource.lower(): institution_id_to_metadata_map.get(institution_id, None) for resource, institution_id in resource_to_institution_id_map.items()
+        }
+        self.resource_group_to_metadata_map = {
+            resource_group.lower(): institution_id_to_metadata_map.get(institution_id, None) for resource_group, institution_id in resource_group_to_institution_id_map.items()
+        }
+
+    @classmethod
+    def from_topology(cls):
+        """Build the resolver from the Topology and Institution API data"""
+
+        return cls(get_resource_to_institution_id_map(), get_resource_group_to_institution_id_map(), get_institution_id_to_metadata_map())
+
+    def resolve(self, record: dict):
+        """Find the matching institution ID and subsequent metadata for the given record"""
+
+        # If the record has an institution ID, use that
+        if 'InstitutionID' in record and record['InstitutionID'] != "UNKNOWN":
+            logger.debug(f"Resource {record['ResourceName']} has InstitutionID {record['InstitutionID']}")
+
+            return self.institution_id_to_metadata_map.get(record['InstitutionID'], None)
+
+        resource = record['ResourceName'].lower()
+
+        # If the record has a resource name, use that
+        if resource in self.resource_to_metadata_map:
+            return self.resource_to_metadata_map[resource]
+
+        # It isn't odd for a 'ResourceName' to be a resource group, so check that too
+        if resource in self.resource_group_to_metadata_map:
+            return self.resource_group_to_metadata_map[resource]
+
+        return None
@@ -0,0 +1,152 @@
+"""
+Local snapshots of the Topology and Institution API reference data
+
+Each payload is fetched at most once per process and saved under SNAPSHOT_DIR with the time it was fetched and the
+sha256 of its content. Later runs refresh a snapshot with a conditional request, so an unchanged payload costs a 304,
+and fall back to the snapshot when the upstream API is failing. With SNAPSHOT_OFFLINE set nothing is requested and
+every payload comes from the last snapshot.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+from summarize.client import get_session
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Directory the snapshots are saved in unless SNAPSHOT_DIR is set. SNAPSHOT_DIR and SNAPSHOT_OFFLINE are read on use
+# so the variables loaded from an --env-file apply
+SNAPSHOT_DIR = Path("./data/snapshots")
+
+_payloads = {}
+_payloads_lock = threading.Lock()
+
+
+def get_snapshot_json(url: str):
+    """
+    Get the JSON payload of a reference data URL, fetched once per process and snapshotted on disk
+
+    :param url: The URL of the payload, each URL has its own snapshot
+    """
+
+    with _payloads_lock:
+        if url not in _payloads:
+            _payloads[url] = refresh_snapshot(url)
+
+        return _payloads[url]
+
+
+def refresh_snapshot(url: str):
+    """Refresh the snapshot of a URL if it changed upstream, returns its payload"""
+
+    path = get_snapshot_path(url)
+    snapshot = load_snapshot(path)
+
+    if is_offline():
+        if snapshot is None:
+            logger.error(f"No snapshot of {url} in {path.parent} to run offline from")
+            raise Exception(f"No snapshot of {url} in {path.parent} to run offline from")
+
+        logger.debug(f"Using the {snapshot['fetched_at']} snapshot of {url}")
+        return snapshot["payload"]
+
+    headers = {}
+    if snapshot is not None:
+        if snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
+
+    try:
+        response = get_session().get(url, headers=headers)
+
+        if response.status_code == 304:
+            logger.debug(f"{url} is unchanged since the {snapshot['fetched_at']} snapshot")
+            return snapshot["payload"]
+
+        if response.status_code != 200:
+            raise Exception(f"{response.status_code} {response.text[:200]}")
+
+        payload = response.json()
+
+    except Exception as e:
+        if snapshot is None:
+            logger.error(f"Failed to get {url} and there is no snapshot of it: {e}")
+            raise Exception(f"Failed to get {url} and there is no snapshot of it: {e}")
+
+        logger.warning(f"Failed to get {url}, using the {snapshot['fetched_at']} snapshot: {e}")
+        return snapshot["payload"]
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if snapshot is not None and snapshot.get("sha256") != content_hash:
+        logger.info(f"{url} changed since the {snapshot['fetched_at']} snapshot")
+
+    save_snapshot(path, {
+        "url": url,
+        "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "sha256": content_hash,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "payload": payload
+    })
+
+    return payload
+
+
+def get_snapshot_path(url: str):
+    """Get the path of a URL's snapshot, ex. data/snapshots/topology.opensciencegrid.org-miscresource-json.json"""
+
+    return get_snapshot_dir() / f"{re.sub(r'[^A-Za-z0-9.]+', '-', url.split('://', 1)[-1]).strip('-')}.json"
+
+
+def get_snapshot_dir():
+    """Get the directory the snapshots are saved in"""
+
+    return Path(os.environ.get("SNAPSHOT_DIR", SNAPSHOT_DIR))
+
+
+def is_offline():
+    """Check if every payload should be served from the last snapshot without touching the network"""
+
+    return os.environ.get("SNAPSHOT_OFFLINE", "").lower() not in ("", "0", "false", "no")
+
+
+def load_snapshot(path: Path):
+    """Load a snapshot, returns None if there is none or it can't be read"""
+
+    if not path.exists():
+        return None
+
+    try:
+        return json.loads(path.read_text())
+    except (IOError, ValueError) as e:
+        logger.warning(f"Could not read {path}, ignoring it: {e}")
+
+    return None
+
+
+def save_snapshot(path: Path, snapshot: dict):
+    """Save a snapshot, written to a temporary file and renamed so it is never partial"""
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(snapshot))
+        tmp_path.replace(path)
+
+    except IOError as e:
+        logger.warning(f"Could not write {path}: {e}")
+
+
+def clear():
+    """Forget the payloads fetched by this process, the next get refreshes them from their snapshots"""
+
+    with _payloads_lock:
+        _payloads.clear()
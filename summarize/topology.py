@@ -1,25 +1,36 @@
-import requests
 import functools
+import os
+
+from summarize.snapshots import get_snapshot_json
+
+# Base URL of the Topology API unless TOPOLOGY_HOST is set, point that at a stand-in server to run offline
+TOPOLOGY_HOST = "https://topology.opensciencegrid.org"
+
+
+def get_topology_host():
+    """Get the base URL of the Topology API, read on use so the variables loaded from an --env-file apply"""
+
+    return os.environ.get("TOPOLOGY_HOST", TOPOLOGY_HOST)
 
 
 @functools.lru_cache(maxsize=1)
 def get_resource_to_institution_id_map():
-    resources = requests.get("https://topology.opensciencegrid.org/miscresource/json").json()
-    facilities = requests.get("https://topology.opensciencegrid.org/miscfacility/json").json()
+    resources = get_snapshot_json(f"{get_topology_host()}/miscresource/json")
+    facilities = get_snapshot_json(f"{get_topology_host()}/miscfacility/json")
 
     return {r['Name'].lower(): facilities[r['Facility']]['InstitutionID'] for r in resources.values()}
 
 
 @functools.lru_cache(maxsize=1)
 def get_resource_group_to_institution_id_map():
-    resources = requests.get("https://topology.opensciencegrid.org/miscresource/json").json()
-    facilities = requests.get("https://topology.opensciencegrid.org/miscfacility/json").json()
+    resources = get_snapshot_json(f"{get_topology_host()}/miscresource/json")
+    facilities = get_snapshot_json(f"{get_topology_host()}/miscfacility/json")
 
     return {r['ResourceGroup'].lower(): facilities[r['Facility']]['InstitutionID'] for r in resources.values()}
 
 
 @functools.lru_cache(maxsize=1)
 def get_acct_group_to_project_metadata_map():
-    acct_groups = requests.get("https://topology.opensciencegrid.org/miscproject/json").json()
+    acct_groups = get_snapshot_json(f"{get_topology_host()}/miscproject/json")
 
     return {k.lower(): v for k, v in acct_groups.items()}
@@ -1,9 +1,16 @@
 import datetime
+import logging
+from typing import Iterable
 
-import requests
 import pandas as pd
 import numpy as np
 
+from summarize.client import get_session
+from summarize.metrics import span
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
 comparison = []
 
 daily_record_mapping = {
@@ -21,15 +28,25 @@ daily_record_default = {
 }
 
 
-def compare_summary_to_daily(date: datetime.date, summary_records: list, host: str = "http://localhost:9200") -> dict:
+def compare_summary_to_daily(date: datetime.date, summary_records: Iterable, host: str = "http://localhost:9200") -> dict:
     """Compares the summary records we generated to the canonical daily reports"""
 
-    summary_agg_keys = daily_record_mapping.values()
-    summary_aggregates = {
-        k: sum([record[k] for record in summary_records if record[k] is not None]) for k in summary_agg_keys
-    }
+    with span("validate", date=date) as validate_span:
+        summary_agg_keys = daily_record_mapping.values()
+
+        # Sum in one pass so the records can be streamed in
+        record_count = 0
+        summary_aggregates = {k: 0 for k in summary_agg_keys}
+        for record in summary_records:
+            record_count += 1
+            for k in summary_agg_keys:
+                if record[k] is not None:
+                    summary_aggregates[k] += record[k]
+
+        validate_span.add(records=record_count)
 
     query = {
+        "_source": list(daily_record_mapping.keys()),
         "query": {
             "terms": {
                 "_id": [f"OSG-schedd-job-history_daily_{date}"]
@@ -37,9 +54,14 @@ def compare_summary_to_daily(date: datetime.date, summary_records: list, host: s
         }
     }
 
-    daily_report = requests.get(f"{host}/daily_totals/_search", json=query, verify=False)
-    daily_report_json = daily_report.json()
-    daily_report_list = daily_report_json["hits"]["hits"]
+    with span("daily_report_search", date=date) as search_span:
+        daily_report = get_session().get(f"{host}/daily_totals/_search", json=query, params={"filter_path": "took,hits.hits._source"}, verify=False)
+        daily_report_json = daily_report.json()
+        search_span.add(bytes_received=len(daily_report.content), es_took_seconds=daily_report_json.get('took', 0) / 1000)
+    logger.debug(f"Searched daily_totals for {date}, received {len(daily_report.content)} bytes")
+
+    # The filter_path drops hits entirely when there are none
+    daily_report_list = daily_report_json.get("hits", {}).get("hits", [])
 
     # If there are no records published that day, return 100% difference
     if len(daily_report_list) == 0: